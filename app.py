@@ -127,15 +127,18 @@ def user_review():
 @app.route('/final-trains')
 def final_trains():
     if processFinished(finalTrainsPath):
-        data = open(finalTrainsPath, "r").read()
+        data = json.loads(open(finalTrainsPath, "r").read())
     else:
         data = None
 
-    logger.info(f"data: {data}, data split: {data.split('Longest:')}")
-    longSplit = data.split('Longest:')
-    longest = longSplit[1].strip()
-    mostPips = longSplit[0].split('Most Pips:')[1].strip()
-    return render_template('final-trains.html', data=data, mostPips=mostPips, longest=longest)
+    logger.info(f"data: {data}")
+    if data is None:
+        # The train builder didn't finish in time, or failed
+        return render_template('final-trains.html', data=None)
+    mostPips = trainText(data["mostPips"])
+    longest = trainText(data["longest"])
+    return render_template('final-trains.html', data=data, mostPips=mostPips, longest=longest,
+                           optimal=data["optimal"])
 
 
 # HELPERS
@@ -193,6 +196,11 @@ def processFinished(path):
     return False
 
 
+# Gives a train from the train builder's result as text, ex. (4, 2) -> (2, 7)
+def trainText(train):
+    return " -> ".join(f"({top}, {bottom})" for top, bottom in train["tiles"])
+
+
 def getRootNumber():
     if os.path.exists(rootNumberPath):
         return int(open(rootNumberPath, "r").read().strip())
@@ -1,11 +1,11 @@
-with open("finalTrains.txt", "r") as file:
-	data = file.read()
+import json
 
+with open("finalTrains.json", "r") as file:
+	data = json.loads(file.read())
 
-longSplit = data.split('Longest:')
-longest = longSplit[1].strip()
-mostPips = longSplit[0].split('Most Pips:')[1].strip()
+
+longest = " -> ".join(f"({top}, {bottom})" for top, bottom in data["longest"]["tiles"])
+mostPips = " -> ".join(f"({top}, {bottom})" for top, bottom in data["mostPips"]["tiles"])
 # mostPips = 0
-print(longSplit)
+print(data)
 print(longest, "\n", mostPips)
-
@@ -32,8 +32,8 @@ def __main__():
     # Program will wait here until web app indicates that user has submitted dominoes for processing or times out
     rawDominoes = extractDominoes()
 
-    highestTrain, longestTrain = trainBuilder.buildTrain(rawDominoes, 9)
-    print(f"Highest train: {highestTrain}\nLongest Train: {longestTrain}")
+    result = trainBuilder.solve(rawDominoes.values(), 9)
+    print(f"Highest train: {result.getMostPips()}\nLongest Train: {result.getLongest()}")
 
 
 def userApproved():
@@ -0,0 +1,177 @@
+# This script benchmarks the train builder's search engines. It makes the same hands every time from a seed, from
+# double-6, double-9, double-12 and double-15 sets at sizes from 8 to 30 dominoes, and solves each one with every
+# engine in trainBuilder.ENGINES, recording the wall time, nodes per second and peak memory to a JSON baseline.
+# A second run can then be compared against the baseline to flag anything that got slower.
+#   python trainBenchmark.py run --out baseline.json
+#   python trainBenchmark.py compare baseline.json current.json --threshold 0.25
+# Besides random hands there are two kinds of hand picked to be hard: one heavy in doubles and one where every domino
+# shares a few pips, with copies, so there are lots of ways to go at every step.
+
+import argparse                 # Command line
+import json                     # Baseline files
+import multiprocessing          # Needed for the parallel engine's worker processes once this is frozen
+import os                       # Writing the results atomically
+import platform
+import random                   # Seeded hands
+import time                     # Wall time
+import tracemalloc              # Peak memory
+import trainBuilder
+
+BENCHMARK_VERSION = 1           # Version of the baseline file format
+SETS = (6, 9, 12, 15)           # Highest pip of each domino set
+SIZES = (8, 12, 16, 20, 25, 30) # Dominoes in a hand
+KINDS = ("random", "doubles", "repeated")
+DEADLINE = 10.0                 # Seconds an engine gets for one hand before it is stopped
+THRESHOLD = 0.25                # How much slower, as a fraction, a case can get before compare flags it
+MIN_SECONDS = 0.05              # Slowdowns smaller than this are noise, like starting the parallel engine's workers
+REPEAT = 3                      # Times each case is timed, the fastest is kept
+
+
+# This method makes a hand from its set, kind and size, the same one every time for the same seed.
+# Returns the domino pairs and the root number.
+def makeHand(highestPip, kind, size, seed):
+    rng = random.Random(f"{seed}-{highestPip}-{kind}-{size}")
+    fullSet = [(top, bottom) for top in range(highestPip + 1) for bottom in range(top, highestPip + 1)]
+    if kind == "doubles":
+        doubles = [(pip, pip) for pip in range(highestPip + 1)]
+        pairs = rng.sample(doubles, min(size, len(doubles)))
+        rest = [pair for pair in fullSet if pair not in pairs]
+        pairs += rng.sample(rest, min(size - len(pairs), len(rest)))
+    elif kind == "repeated":
+        # Dominoes on a handful of pips, taken from two sets so some come twice
+        pips = rng.sample(range(highestPip + 1), min(highestPip + 1, 5))
+        fewPips = [(top, bottom) for top in pips for bottom in pips if top <= bottom]
+        pairs = rng.sample(fewPips * 2, min(size, 2 * len(fewPips)))
+    else:
+        pairs = rng.sample(fullSet, min(size, len(fullSet)))
+    rng.shuffle(pairs)
+    # Start on the pip the most dominoes have, so there is a real train to find
+    counts = {}
+    for top, bottom in pairs:
+        counts[top] = counts.get(top, 0) + 1
+        counts[bottom] = counts.get(bottom, 0) + 1
+    rootNumber = max(sorted(counts), key=lambda pip: counts[pip])
+    return pairs, rootNumber
+
+
+# This method solves a hand with one engine, timed up to repeat times but at least once, keeping the fastest, and once
+# more under tracemalloc for the peak memory, since tracing slows the search down too much to time it at the same
+# time. A case that takes over a second is only timed once, it is long enough not to be noise. The parallel engine's
+# memory is only the main process's.
+# Returns the case's record.
+def runCase(pairs, rootNumber, engine, deadline, repeat=REPEAT):
+    seconds = None
+    for _ in range(max(repeat, 1)):
+        startTime = time.perf_counter()
+        result = trainBuilder.solve(pairs, rootNumber, engine, deadline=deadline)
+        elapsed = time.perf_counter() - startTime
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+        if elapsed > 1:
+            break
+    tracemalloc.start()
+    trainBuilder.solve(pairs, rootNumber, engine, deadline=deadline)
+    peakBytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"engine": engine, "seconds": seconds, "nodes": result.getNodes(),
+            "nodesPerSecond": result.getNodes() / seconds if seconds else 0.0, "peakBytes": peakBytes,
+            "optimal": result.isOptimal(), "timedOut": seconds >= deadline,
+            "pips": result.getMostPips().getDotCount(), "length": result.getLongest().getDominoCount()}
+
+
+# This method runs every engine on every hand. An engine that runs out of time on a hand isn't run on the bigger hands
+# of the same set and kind, since they would only run out of time too.
+# Returns the baseline as a dictionary.
+def runBenchmark(seed=0, sets=SETS, sizes=SIZES, kinds=KINDS, engines=None, deadline=DEADLINE, repeat=REPEAT):
+    engines = list(engines or trainBuilder.ENGINES)
+    cases = []
+    for highestPip in sets:
+        for kind in kinds:
+            timedOut = set()
+            for size in sorted(sizes):
+                pairs, rootNumber = makeHand(highestPip, kind, size, seed)
+                for engine in engines:
+                    if engine in timedOut:
+                        continue
+                    record = runCase(pairs, rootNumber, engine, deadline, repeat)
+                    record.update({"set": highestPip, "kind": kind, "size": len(pairs), "root": rootNumber})
+                    cases.append(record)
+                    print(f"double-{highestPip} {kind} {len(pairs):>2} {engine:<8} {record['seconds']:8.3f}s "
+                          f"{record['nodesPerSecond']:12.0f} nodes/s {record['peakBytes'] / 1024:10.0f} KiB"
+                          + (" timed out" if record["timedOut"] else ""))
+                    if record["timedOut"]:
+                        timedOut.add(engine)
+    return {"version": BENCHMARK_VERSION, "seed": seed, "deadline": deadline, "python": platform.python_version(),
+            "machine": platform.machine(), "cases": cases}
+
+
+# This method compares a run against a baseline. A case that both runs finished is flagged if its wall time or peak
+# memory grew by more than the threshold, or if it found different trains. A slowdown also has to be more than
+# MIN_SECONDS, the fastest cases are mostly noise. A case that timed out now but didn't in the baseline is flagged
+# too. Cases in only one of the runs are skipped.
+# Returns a list of what was flagged, as text.
+def compareBenchmarks(baseline, current, threshold=THRESHOLD):
+    def caseKey(case):
+        return case["set"], case["kind"], case["size"], case["engine"]
+
+    baseCases = {caseKey(case): case for case in baseline["cases"]}
+    regressions = []
+    for case in current["cases"]:
+        base = baseCases.get(caseKey(case))
+        if base is None or base["timedOut"]:
+            continue
+        name = "double-{} {} {} {}".format(*caseKey(case))
+        if case["timedOut"]:
+            regressions.append(f"{name}: timed out, took {base['seconds']:.3f}s before")
+            continue
+        if case["seconds"] > base["seconds"] * (1 + threshold) and case["seconds"] - base["seconds"] > MIN_SECONDS:
+            regressions.append(f"{name}: {base['seconds']:.3f}s -> {case['seconds']:.3f}s")
+        if case["peakBytes"] > base["peakBytes"] * (1 + threshold):
+            regressions.append(f"{name}: peak memory {base['peakBytes']} -> {case['peakBytes']} bytes")
+        if case["optimal"] and base["optimal"] and (case["pips"], case["length"]) != (base["pips"], base["length"]):
+            regressions.append(f"{name}: trains changed from {base['pips']} pips and {base['length']} long to "
+                               f"{case['pips']} pips and {case['length']} long")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the train builder's search engines.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run the benchmark and write its results")
+    run.add_argument("--out", default="trainBenchmark.json", help="file to write the results to")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--sets", type=int, nargs="+", default=SETS, help="highest pips of the domino sets")
+    run.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    run.add_argument("--kinds", nargs="+", default=KINDS, choices=KINDS)
+    run.add_argument("--engines", nargs="+", choices=sorted(trainBuilder.ENGINES))
+    run.add_argument("--deadline", type=float, default=DEADLINE, help="seconds an engine gets per hand")
+    run.add_argument("--repeat", type=int, default=REPEAT, help="times to time each case, the fastest is kept")
+    compare = commands.add_parser("compare", help="compare results against a baseline")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=THRESHOLD, help="fraction slower that is flagged")
+    args = parser.parse_args()
+
+    if args.command == "run" and args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    if args.command == "run":
+        results = runBenchmark(args.seed, args.sets, args.sizes, args.kinds, args.engines, args.deadline, args.repeat)
+        with open(args.out + ".tmp", "w") as file:
+            file.write(json.dumps(results, indent=1))
+        os.replace(args.out + ".tmp", args.out)
+        return 0
+
+    with open(args.baseline, "r") as file:
+        baseline = json.loads(file.read())
+    with open(args.current, "r") as file:
+        current = json.loads(file.read())
+    regressions = compareBenchmarks(baseline, current, args.threshold)
+    for regression in regressions:
+        print(regression)
+    print(f"{len(regressions)} regressions over {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+# The parallel engine's worker processes import this module too, so it only runs as the main script.
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    raise SystemExit(main())
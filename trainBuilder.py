@@ -2,21 +2,49 @@
 # and returns the train that has the most dots and the train that has the most dominos. Often this is the same train,
 # however it could easily differ and strategy could call for a specific one.
 
-from copy import deepcopy       # Necessary for storing all possible train combinations
 from dotenv import load_dotenv  # Getting environment
 import logging                  # Helpful for getting information
 import os                       # Needed for logging to get environment variable for log level
 import json
+import time                     # Stopping a search at its deadline
+import heapq                    # Keeping the best trains without sorting all of them
+from collections import OrderedDict     # Least recently used order for the memo table
+from concurrent.futures import ProcessPoolExecutor     # Searching parts of the train tree at the same time
+import multiprocessing          # Needed for worker processes once this is frozen into an executable
+import mmap                     # Keeping the transposition table in a file between runs
+import struct
+from hashlib import blake2b     # Fingerprints for dominoes that are the same in every run
 
-load_dotenv('config.env')
-# Logging setup
-log_level = os.getenv('LOG_LEVEL', 'ERROR').upper()
-logging.basicConfig(level=getattr(logging, log_level, logging.ERROR), format='%(message)s')
 logger = logging.getLogger(__name__)
 
-imgProcessorOutputPath = os.getenv('IMAGE_PROCESSOR_OUTPUT_PATH')
-rootNumberPath = os.getenv('ROOT_NUM_PATH')
-finalOutputPath = os.getenv('TRAIN_BUILDER_OUTPUT_PATH')
+# Set from the environment by loadEnvironment, when this runs as the executable
+imgProcessorOutputPath = None
+rootNumberPath = None
+finalOutputPath = None
+trainEngine = 'bitmask'
+transpositionTablePath = None
+resultCachePath = None
+searchDeadline = None
+
+MAX_PIP = 12                # Highest pip on a domino in a double-12 set
+MEMO_TABLE_SIZE = 500000    # Most search states the memoised search keeps at once
+EULER_FINISH = -2           # Memo entry move meaning "finish with a trail through every domino left"
+TRANSPOSITION_TABLE_SIZE = 1 << 20  # Most states the transposition table file keeps, about 28MB
+TRANSPOSITION_TABLE_WAYS = 4        # States that can share one bucket of the file
+RESULT_CACHE_SIZE = 1000            # Most hands the result cache remembers
+BOUND_CACHE_SIZE = 1 << 20         # Most search states a pruning search keeps the reachable bound of
+DEADLINE_CHECK = 1023               # The searches check the clock when the node count has none of these bits set
+OBJECTIVES = ("pips", "longest")    # What a best train can be picked for: most dots or most dominoes
+BEAM_WIDTH = 256                    # Partial trains the beam search keeps at each length
+RESULT_VERSION = 1                  # Version of the JSON result format, see TrainResult.toDict
+
+# A double on the open end never hurts either goal: it keeps the same number open and adds dominoes and dots. Any
+# train can be changed to play each of its doubles the first time that number is open without losing anything, and a
+# train that skips an available double can only gain by playing it. So when only the best trains are wanted, the
+# searches play an open double straight away instead of also trying every other domino first. That takes a factor
+# off the search for every double in the hand. It isn't done when keeping a top K, since the alternatives that skip
+# or delay a double are trains of their own.
+DOUBLES_FIRST = True
 
 
 # This represents a single Domino with two numbers divided by a horizontal line. The numbers are internally called top
@@ -28,6 +56,7 @@ finalOutputPath = os.getenv('TRAIN_BUILDER_OUTPUT_PATH')
 # in the internally stored tuple for readability when the final train is built. The root domino is considered the first
 # number in the tuple.
 # Two dominoes are considered equal if the two numbers on the domino are the same, even if their root numbers differ.
+# Their hash is taken from the numbers low one first, so (3, 5) and (5, 3) also hash the same and a set keeps only one.
 # A Domino is represented by a tuple when printed. ex. (4, 2)
 class Domino:
     def __init__(self, top, bottom):
@@ -47,7 +76,7 @@ class Domino:
         return False
 
     def __hash__(self):
-        return hash(self.__pair)
+        return hash(self.getCode())
 
     def setRootNumber(self, newRootNumber):
         if newRootNumber not in self.__pair:
@@ -62,6 +91,10 @@ class Domino:
     def getPair(self):
         return self.__pair
 
+    # This is the domino's numbers low one first, the same whichever way the domino is facing.
+    def getCode(self):
+        return min(self.__pair), max(self.__pair)
+
     def getDotCount(self):
         return self.__dotCount
 
@@ -71,97 +104,979 @@ class Domino:
         return self.__pair[0] if number == self.__pair[1] else self.__pair[1]
 
 
-# This represents a chain of dominoes, "train", ordered according to matching sides. I played around with different ways
-# of internally storing the dominoes and found that a list was the easiest way of thinking about it. It doesn't need
-# to be incredibly memory efficient or processor efficient because the longest train possible is only 12 dominoes
-# according to the rules of the game. Only one domino can be added to a Train at a time.
-# The only data the Train maintains about itself is the dominoes and their order. You may ask a train what it's dot
-# count or domino count is but that is calculated when asked instead of maintaining it. I had pretty much already
-# written both those methods elsewhere in the file and then decided to make them internal to the Train class so that
-# you could just ask the Train about itself instead of calling another function to figure it out.
+# This represents a chain of dominoes, "train", ordered according to matching sides. The longest train possible is only
+# 12 dominoes according to the rules of the game, but searching for the best train copies trains an enormous number of
+# times, so a Train is stored as a chain of links, each one pointing back at the link before it. Adding a domino makes
+# one new link on the end and copying a train just points the copy at the same last link, so trains that start the
+# same way share those links and a copy never costs more than one object. Only one domino can be added to a Train at a
+# time.
+# Each link also keeps the running dot count and domino count, so asking a train about either doesn't have to walk the
+# chain.
 # Individual dominoes cannot be accessed in the Train. You can ask the train if it has a certain domino, but you can't
 # directly access them to figure what ones are in there.
 # You can ask a Train to "reset" itself back to a certain domino you know is in the train.  When you reset the Train
 # back a certain domino, it removes every domino after and including the specified domino. This was for building all of
 # the possible combinations of Trains.
+# Two trains are equal only if they have the same dominoes in the same order facing the same way. Their key for this is
+# the tuple of domino pairs as they were when added, read off the links. Each link keeps its pair as it was when added,
+# since the Domino itself may be turned around later by another train. Each link also keeps the hash of the key up to
+# it, worked out from the link before when the domino is added, so hashing a train never walks the chain. Comparing
+# two trains only walks them when their hashes and lengths match, and stops as soon as they reach a shared link.
 # A Train is represented with a list of dominoes (tuples) pointing to each other. The numbers should match up on either
 # side of a tuple with the tuple next to it.
 class Train:
     def __init__(self):
-        self.__dominos = []
+        self.__last = None     # (previous link, domino, pair, dot count, domino count, key hash)
 
     def __str__(self):
-        prettyTrainStr = ""
-        for domino in self.__dominos:
-            prettyTrainStr += str(domino) + " -> "
-        return prettyTrainStr[:-4]
+        return " -> ".join(f"({pair[0]}, {pair[1]})" for pair in self.getKey())
 
     def __repr__(self):
-        prettyTrainStr = ""
-        for domino in self.__dominos:
-            prettyTrainStr += str(domino) + " -> "
-        return prettyTrainStr[:-4]
+        return " -> ".join(f"({pair[0]}, {pair[1]})" for pair in self.getKey())
 
     def __eq__(self, otherObj):
-        if isinstance(otherObj, Train):
-            return set(self.__dominos) == set(otherObj.__dominos)
-        return False
+        if not isinstance(otherObj, Train):
+            return False
+        link = self.__last
+        otherLink = otherObj.__last
+        if link is None or otherLink is None:
+            return link is otherLink
+        if link[5] != otherLink[5] or link[4] != otherLink[4]:
+            return False
+        while link is not otherLink:
+            if link[2] != otherLink[2]:
+                return False
+            link = link[0]
+            otherLink = otherLink[0]
+        return True
 
     def __hash__(self):
-        return hash((len(self.__dominos) * self.getDotCount() + self.getDominoCount()) * 71)
+        return hash(()) if self.__last is None else self.__last[5]
 
     def addDomino(self, newDomino):
-        self.__dominos.append(newDomino)
+        last = self.__last
+        pair = newDomino.getPair()
+        if last is None:
+            self.__last = (None, newDomino, pair, newDomino.getDotCount(), 1, hash((pair,)))
+        else:
+            self.__last = (last, newDomino, pair, last[3] + newDomino.getDotCount(), last[4] + 1, hash((last[5], pair)))
 
     # This method rewrites the train to remove all dominos after and including the domino passed.
     # If no domino is passed, the train is erased completely.
     def reset(self, domino=None):
         if domino is None:
-            self.__dominos = []
-        elif domino not in self.__dominos:
+            self.__last = None
             return
-        else:
-            self.__dominos = self.__dominos[:self.__dominos.index(domino)]
+        found = None
+        link = self.__last
+        while link is not None:
+            if link[1] == domino:
+                found = link
+            link = link[0]
+        if found is not None:
+            self.__last = found[0]
 
     def getDotCount(self):
-        count = 0
-        for domino in self.__dominos:
-            count += domino.getDotCount()
-        return count
+        return 0 if self.__last is None else self.__last[3]
 
     def getDominoCount(self):
-        return len(self.__dominos)
+        return 0 if self.__last is None else self.__last[4]
+
+    def getKey(self):
+        pairs = []
+        link = self.__last
+        while link is not None:
+            pairs.append(link[2])
+            link = link[0]
+        pairs.reverse()
+        return tuple(pairs)
 
     def getCopy(self):
-        return deepcopy(self)
+        train = Train()
+        train.__last = self.__last
+        return train
 
     def isInTrain(self, domino):
-        return domino in self.__dominos
+        link = self.__last
+        while link is not None:
+            if link[1] == domino:
+                return True
+            link = link[0]
+        return False
+
+
+# This represents a pool of dominoes prepared for searching. Each domino gets an integer index and any group of the
+# dominoes can then be stored as a bitmask, bit i meaning the domino at index i is in the group. Taking a domino out of
+# the pool or putting it back is a single integer operation instead of building a new set of Domino objects.
+# The hand keeps the plain pairs and dot counts by index, in the order the dominoes were given, so a hand built again
+# from getTiles has the same indices. Domino objects are only created again with makeTrain for the trains that
+# actually get reported.
+# The pool is a multiset, the same domino may be given more than once either way around. The copies are moved next to
+# the first one so they get neighbouring indices, and a copy may only be played once the copy before it has been. The
+# copies are then always used in the same order, so the searches try each kind of domino once at an open end instead
+# of once per copy, and the same trains aren't found again with the copies swapped. The bits of the copies after the
+# first are kept in a copy mask, and getPlayable leaves out any of them whose earlier copy is still in the pool.
+# A full mask can be given to leave some of the pool out of the hand. A TrainPlanner uses this to keep the indices of
+# dominoes that have left the hand, since its memo table is keyed on them.
+# The hand also keeps an index from pip value to the dominoes showing that pip, stored as one bitmask per pip. The
+# dominoes that can be played on an open end are then just the remaining pool ANDed with that pip's mask, so using a
+# domino updates the lookup in O(1) and finding playable dominoes only costs as much as the dominoes that match. The
+# doubles get a mask per pip of their own.
+class DominoHand:
+    def __init__(self, dominoPool, fullMask=None):
+        copies = {}
+        for domino in dominoPool:
+            copies.setdefault(domino.getCode(), []).append(domino)
+        self.__dominoes = [domino for group in copies.values() for domino in group]
+        self.__tiles = []
+        self.__dots = []
+        for domino in self.__dominoes:
+            self.__tiles.append(domino.getPair())
+            self.__dots.append(domino.getDotCount())
+        self.__fullMask = (1 << len(self.__tiles)) - 1 if fullMask is None else fullMask
+
+        highestPip = max([MAX_PIP] + [max(pair) for pair in self.__tiles])
+        self.__pipMasks = [0] * (highestPip + 1)
+        self.__doubleMasks = [0] * (highestPip + 1)
+        self.__copyMask = 0
+        for index, (top, bottom) in enumerate(self.__tiles):
+            self.__pipMasks[top] |= 1 << index
+            self.__pipMasks[bottom] |= 1 << index
+            if top == bottom:
+                self.__doubleMasks[top] |= 1 << index
+            if index and self.__dominoes[index] == self.__dominoes[index - 1]:
+                self.__copyMask |= 1 << index
+
+    def __str__(self):
+        return str([self.__tiles[index] for index in _maskIndices(self.__fullMask)])
+
+    def __repr__(self):
+        return str([self.__tiles[index] for index in _maskIndices(self.__fullMask)])
+
+    def __len__(self):
+        return bin(self.__fullMask).count("1")
+
+    def getDominoes(self):
+        return self.__dominoes
+
+    def getTiles(self):
+        return self.__tiles
+
+    def getDots(self):
+        return self.__dots
+
+    def getFullMask(self):
+        return self.__fullMask
+
+    def getPipMasks(self):
+        return self.__pipMasks
+
+    def getDoubleMasks(self):
+        return self.__doubleMasks
+
+    def getCopyMask(self):
+        return self.__copyMask
+
+    # This method gives the mask of the dominoes in the mask that can be played on the pip, leaving out the copies
+    # that have to wait for an earlier copy. The searches do the same thing inline.
+    def getPlayable(self, mask, pip):
+        return mask & self.__pipMasks[pip] & ~(mask << 1 & self.__copyMask)
+
+    # This method gives an upper bound on what a train could still gain from the given pip with the dominoes in the
+    # mask. Only dominoes connected to the pip could ever be played, so it returns the total dots and number of the
+    # dominoes in the pip's component, less the dominoes the odd pips force it to leave out. Whichever those are, they
+    # have at least as many dots as the same number of the component's smallest dominoes, so those come off the dots.
+    def getReachableBound(self, mask, pip):
+        reach, dotCount, dominoCount, oddPips = self.getComponent(mask, pip)
+        leftOut = _leftOutCount(oddPips, pip)
+        if leftOut:
+            dots = self.__dots
+            dotCount -= sum(heapq.nsmallest(leftOut, [dots[index] for index in _maskIndices(reach)]))
+        return dotCount, dominoCount - leftOut
+
+    # This method finds the dominoes in the mask that are connected to the given pip, directly or through other
+    # dominoes in the mask. No other domino could ever be added to a train ending on that pip. Thinking of the pips as
+    # points and the dominoes as lines between them, this is the pip's connected component.
+    # Returns the mask of those dominoes, their total dots, how many there are and a mask of the pips that show up on
+    # an odd number of them.
+    def getComponent(self, mask, pip):
+        tiles = self.__tiles
+        dots = self.__dots
+        pipMasks = self.__pipMasks
+        seen = 1 << pip
+        reach = frontier = mask & pipMasks[pip]
+        dotCount = dominoCount = oddPips = 0
+        while frontier:
+            newTiles = 0
+            while frontier:
+                bit = frontier & -frontier
+                frontier ^= bit
+                index = bit.bit_length() - 1
+                top, bottom = tiles[index]
+                dotCount += dots[index]
+                dominoCount += 1
+                oddPips ^= (1 << top) ^ (1 << bottom)
+                if not seen >> top & 1:
+                    seen |= 1 << top
+                    newTiles |= pipMasks[top]
+                if not seen >> bottom & 1:
+                    seen |= 1 << bottom
+                    newTiles |= pipMasks[bottom]
+            frontier = newTiles & mask & ~reach
+            reach |= frontier
+        return reach, dotCount, dominoCount, oddPips
+
+    # This method returns a train, as a list of indices, that starts on the pip and uses every domino in the mask,
+    # using Hierholzer's algorithm. It only makes sense when such a train exists: the dominoes are all connected to the
+    # pip and _leftOutCount is 0.
+    def getEulerTrail(self, mask, pip):
+        tiles = self.__tiles
+        pipMasks = self.__pipMasks
+        stack = [(pip, -1)]
+        trail = []
+        while stack:
+            current, arrivedBy = stack[-1]
+            edges = mask & pipMasks[current]
+            if edges:
+                bit = edges & -edges
+                mask ^= bit
+                index = bit.bit_length() - 1
+                top, bottom = tiles[index]
+                stack.append((bottom if top == current else top, index))
+            else:
+                stack.pop()
+                if arrivedBy >= 0:
+                    trail.append(arrivedBy)
+        trail.reverse()
+        return trail
+
+    # This method returns the indices of the dominoes in the mask that can be played on the given pip. With
+    # doublesFirst, an open double is the only one returned, the same way the searches play it, see DOUBLES_FIRST.
+    def getRootTiles(self, mask, pip, doublesFirst=False):
+        if pip < 0 or pip >= len(self.__pipMasks):
+            return []
+        playable = self.getPlayable(mask, pip)
+        if doublesFirst and playable & self.__doubleMasks[pip]:
+            playable &= self.__doubleMasks[pip]
+            playable &= -playable
+        return _maskIndices(playable)
+
+    # This method turns a path of domino indices back into a Train, starting from the root number.
+    def makeTrain(self, path, rootNumber):
+        train = Train()
+        for index in _pathIndices(path):
+            domino = Domino(*self.__tiles[index])
+            domino.setRootNumber(rootNumber)
+            train.addDomino(domino)
+            rootNumber = domino.getOtherNumber(rootNumber)
+        return train
+
+
+# This collects the results of a train search as they are found instead of after the search is done. Every complete
+# train is offered to the collector, but it only holds on to the best train for each goal, so memory stays the same no
+# matter how many trains the search finds. The most pips train breaks ties on length and the longest train breaks
+# ties on dots, matching what buildTrain reports.
+# If topK is more than 0, the collector also keeps the topK best trains in a bounded heap, which is cheaper than
+# sorting every train at the end. The objective says what best means for the heap: "pips" ranks trains by dots then
+# length, "longest" by length then dots.
+# A search that stops early marks the collector incomplete, see isComplete.
+# If frontier is True, the collector also keeps the train with the most dots for each length. The ones with more dots
+# than every longer train make up the Pareto frontier of dots against length, see getFrontier. Both goals' best trains
+# are on it, so one search gives the whole trade-off between them.
+# A search offers its train in whatever form it builds it in. If the search keeps changing that object, the collector
+# is given a snapshot function that makes a stored copy of it, and the copy is only made for trains that are kept.
+# Paths and Trains share their links with the trains they were built from, so they never need one.
+class TrainCollector:
+    def __init__(self, topK=0, snapshot=None, objective="pips", frontier=False):
+        if objective not in OBJECTIVES:
+            raise ValueError(f"Unknown objective {objective}, expected one of {OBJECTIVES}")
+        self.__topK = topK
+        self.__snapshot = snapshot
+        self.__objective = objective
+        self.__longestFirst = objective == "longest"
+        self.__mostPips = None     # (dot count, domino count, train)
+        self.__longest = None      # (dot count, domino count, train)
+        self.__heap = []           # (rank, order found, dot count, domino count, train), smallest rank first
+        self.__frontier = {} if frontier else None      # domino count: (dot count, train)
+        self.__trainCount = 0
+        self.__order = 0
+        self.__complete = True
+
+    def __store(self, train):
+        return train if self.__snapshot is None else self.__snapshot(train)
+
+    def offer(self, dotCount, dominoCount, train):
+        self.__trainCount += 1
+        stored = self.__offerBest(dotCount, dominoCount, train)
+        if self.__topK > 0:
+            stored = self.__offerTop(dotCount, dominoCount, train, stored)
+        if self.__frontier is not None:
+            self.__offerFrontier(dotCount, dominoCount, train, stored)
+
+    # This method adds everything another collector kept, for example one filled by a search in another process.
+    def merge(self, otherCollector):
+        for dotCount, dominoCount, train in otherCollector.getTopTrains():
+            self.__offerTop(dotCount, dominoCount, train, None)
+        for best in (otherCollector.getMostPips(), otherCollector.getLongest()):
+            if best is not None:
+                self.__offerBest(*best)
+        if self.__frontier is not None:
+            for dotCount, dominoCount, train in otherCollector.getFrontier():
+                self.__offerFrontier(dotCount, dominoCount, train, None)
+        self.__trainCount += otherCollector.getTrainCount()
+        if not otherCollector.isComplete():
+            self.__complete = False
+
+    # Keeps the train if it beats the most pips or longest train so far. Returns the stored copy if one was made.
+    def __offerBest(self, dotCount, dominoCount, train):
+        stored = None
+        mostPips = self.__mostPips
+        if mostPips is None or dotCount > mostPips[0] or (dotCount == mostPips[0] and dominoCount > mostPips[1]):
+            stored = self.__store(train)
+            self.__mostPips = (dotCount, dominoCount, stored)
+        longest = self.__longest
+        if longest is None or dominoCount > longest[1] or (dominoCount == longest[1] and dotCount > longest[0]):
+            if stored is None:
+                stored = self.__store(train)
+            self.__longest = (dotCount, dominoCount, stored)
+        return stored
+
+    def __offerTop(self, dotCount, dominoCount, train, stored):
+        heap = self.__heap
+        self.__order += 1
+        rank = (dominoCount, dotCount) if self.__longestFirst else (dotCount, dominoCount)
+        if len(heap) < self.__topK:
+            if stored is None:
+                stored = self.__store(train)
+            heapq.heappush(heap, (rank, self.__order, dotCount, dominoCount, stored))
+        elif rank > heap[0][0]:
+            if stored is None:
+                stored = self.__store(train)
+            heapq.heapreplace(heap, (rank, self.__order, dotCount, dominoCount, stored))
+        return stored
+
+    def __offerFrontier(self, dotCount, dominoCount, train, stored):
+        best = self.__frontier.get(dominoCount)
+        if best is None or dotCount > best[0]:
+            self.__frontier[dominoCount] = (dotCount, self.__store(train) if stored is None else stored)
+
+    # Returns (dot count, domino count, train) for the train with the most dots, or None if nothing was offered.
+    def getMostPips(self):
+        return self.__mostPips
+
+    # Returns (dot count, domino count, train) for the train with the most dominoes, or None if nothing was offered.
+    def getLongest(self):
+        return self.__longest
+
+    # This method tells a search whether a train with at most the given dots and dominoes could still replace one of
+    # the kept trains. If not, the branch that could at best make such a train can be skipped.
+    def canImprove(self, dotBound, dominoBound):
+        mostPips = self.__mostPips
+        longest = self.__longest
+        if mostPips is None or longest is None:
+            return True
+        if dotBound > mostPips[0] or (dotBound == mostPips[0] and dominoBound > mostPips[1]):
+            return True
+        if dominoBound > longest[1] or (dominoBound == longest[1] and dotBound > longest[0]):
+            return True
+        if self.__topK > 0:
+            heap = self.__heap
+            rank = (dominoBound, dotBound) if self.__longestFirst else (dotBound, dominoBound)
+            if len(heap) < self.__topK or rank > heap[0][0]:
+                return True
+        if self.__frontier is not None:
+            # Every train the branch could make is beaten if a kept train is at least as long with at least as many dots
+            for dominoCount, (dotCount, _) in self.__frontier.items():
+                if dominoCount >= dominoBound and dotCount >= dotBound:
+                    return False
+            return True
+        return False
+
+    # Returns the kept trains as (dot count, domino count, train), best first for the objective.
+    def getTopTrains(self):
+        return [(dotCount, dominoCount, train)
+                for _, _, dotCount, dominoCount, train in sorted(self.__heap, key=lambda x: (-x[0][0], -x[0][1], x[1]))]
+
+    # Returns the Pareto frontier of the trains offered as (dot count, domino count, train), shortest first. Every
+    # train on it has more dots than any longer train and nothing offered has both more dots and more dominoes. It
+    # is empty unless the collector was made with frontier=True.
+    def getFrontier(self):
+        if self.__frontier is None:
+            return []
+        frontier = []
+        for dominoCount in sorted(self.__frontier, reverse=True):
+            dotCount, train = self.__frontier[dominoCount]
+            if not frontier or dotCount > frontier[-1][0]:
+                frontier.append((dotCount, dominoCount, train))
+        frontier.reverse()
+        return frontier
+
+    def getTrainCount(self):
+        return self.__trainCount
+
+    # A search that stops at its deadline marks its collector, so the trains kept are only the best found so far.
+    def markIncomplete(self):
+        self.__complete = False
+
+    # Returns True if every train was searched, so the kept trains are proven to be the best.
+    def isComplete(self):
+        return self.__complete
+
+    def getTopK(self):
+        return self.__topK
+
+    def getObjective(self):
+        return self.__objective
+
+    def hasFrontier(self):
+        return self.__frontier is not None
+
+
+# This keeps the counters for one search, to tell why one hand takes far longer than another. The engines count into
+# plain local integers and add them here once when they finish, and the clock is only read where the deadline is
+# checked, every DEADLINE_CHECK + 1 nodes, so it is cheap enough to leave on. It counts:
+#   - nodes: the nodes or states searched, what the engine returns
+#   - leaves: the trains that couldn't be played on, or the states with nothing left to play for the memo and graph
+#     engines
+#   - pruned: the branches skipped since they couldn't beat the kept trains, or the partial trains the beam dropped
+#   - memo hits and misses: the states found in the MemoTable, or the TranspositionTable if there is one, and the
+#     states that had to be solved, for the memo and graph engines
+#   - max depth: the most dominoes played on any path searched
+#   - depth seconds: the time spent at each depth, sampled. At each clock reading the time since the last one goes to
+#     the depth the search is at then, so it adds up over a long search but says little about a short one.
+# Worker processes fill their own and they are merged into the parent's. toDict gives the counters as one record.
+class SearchStats:
+    def __init__(self):
+        self.__nodes = 0
+        self.__leaves = 0
+        self.__pruned = 0
+        self.__memoHits = 0
+        self.__memoMisses = 0
+        self.__maxDepth = 0
+        self.__depthSeconds = []
+        self.__lastSample = time.monotonic()
+
+    # Called by a search when it reads the clock, now being the time.monotonic() it read.
+    def sample(self, depth, now):
+        depthSeconds = self.__depthSeconds
+        while len(depthSeconds) <= depth:
+            depthSeconds.append(0.0)
+        depthSeconds[depth] += now - self.__lastSample
+        self.__lastSample = now
+
+    def add(self, nodes=0, leaves=0, pruned=0, memoHits=0, memoMisses=0, maxDepth=0):
+        self.__nodes += nodes
+        self.__leaves += leaves
+        self.__pruned += pruned
+        self.__memoHits += memoHits
+        self.__memoMisses += memoMisses
+        self.__maxDepth = max(self.__maxDepth, maxDepth)
+
+    def merge(self, otherStats):
+        self.add(otherStats.getNodes(), otherStats.getLeaves(), otherStats.getPruned(), otherStats.getMemoHits(),
+                 otherStats.getMemoMisses(), otherStats.getMaxDepth())
+        for depth, seconds in enumerate(otherStats.getDepthSeconds()):
+            if depth == len(self.__depthSeconds):
+                self.__depthSeconds.append(0.0)
+            self.__depthSeconds[depth] += seconds
+
+    def getNodes(self):
+        return self.__nodes
+
+    def getLeaves(self):
+        return self.__leaves
+
+    def getPruned(self):
+        return self.__pruned
+
+    def getMemoHits(self):
+        return self.__memoHits
+
+    def getMemoMisses(self):
+        return self.__memoMisses
+
+    def getMaxDepth(self):
+        return self.__maxDepth
+
+    def getDepthSeconds(self):
+        return self.__depthSeconds
+
+    def toDict(self):
+        return {"nodes": self.__nodes, "leaves": self.__leaves, "pruned": self.__pruned, "memoHits": self.__memoHits,
+                "memoMisses": self.__memoMisses, "maxDepth": self.__maxDepth,
+                "depthSeconds": [round(seconds, 6) for seconds in self.__depthSeconds]}
+
+
+# This is a cache of solved search states for the memoised search. A state is the dominoes still left in the pool and
+# the number showing on the end of the train, and the best way to finish a train from there never depends on how the
+# train got there. The cache is bounded: once it holds maxSize states, the least recently used one is dropped, so memory
+# stays capped on big hands at the cost of solving some states again.
+class MemoTable:
+    def __init__(self, maxSize=MEMO_TABLE_SIZE):
+        self.__maxSize = maxSize
+        self.__states = OrderedDict()
+        self.__hits = 0
+        self.__misses = 0
+
+    def __len__(self):
+        return len(self.__states)
+
+    def get(self, key):
+        entry = self.__states.get(key)
+        if entry is None:
+            self.__misses += 1
+            return None
+        self.__hits += 1
+        self.__states.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.__states[key] = entry
+        if len(self.__states) > self.__maxSize:
+            self.__states.popitem(last=False)
+
+    def clear(self):
+        self.__states.clear()
+
+    def getHits(self):
+        return self.__hits
+
+    def getMisses(self):
+        return self.__misses
+
+
+# This is a transposition table kept in a file, so solved states outlive the run that solved them and any later hand
+# holding the same dominoes can use them. The memo engine checks it when a state isn't in its MemoTable and writes
+# every state it solves to it.
+# A MemoTable key only makes sense for one hand, so states here are keyed on what they hold instead: a fingerprint of
+# the dominoes left plus the open end. Each kind of domino gets a fixed random 64 bit number from its low and high
+# numbers, and the fingerprint of a group of dominoes is the sum of their numbers. A sum doesn't care about order and
+# counts copies, so the same dominoes always give the same fingerprint, in any hand. The moves in an entry are stored
+# as the domino's numbers too and turned back into indices for the hand asking.
+# The file is memory mapped and split into buckets of TRANSPOSITION_TABLE_WAYS slots. A state can only go in the bucket
+# its key picks. Every read or write stamps the slot with a counter, and a new state that finds its bucket full takes
+# the slot used longest ago, so the file never grows past maxSize states.
+# Only one solver should write to a file at a time.
+class TranspositionTable:
+    MAGIC = b"TRTT"
+    VERSION = 2
+    HEADER = struct.Struct("<4sIIIQ")       # magic, version, buckets, ways, use counter
+    # fingerprint, open end + 1 (0 for an empty slot), pips dots, pips length, longest length, longest dots, pips move
+    # low and high, longest move low and high (255 for no move), last use
+    RECORD = struct.Struct("<QBHBBHBBBBQ")
+
+    def __init__(self, path, maxSize=TRANSPOSITION_TABLE_SIZE):
+        self.__ways = TRANSPOSITION_TABLE_WAYS
+        self.__buckets = max(1, maxSize // self.__ways)
+        size = self.HEADER.size + self.__buckets * self.__ways * self.RECORD.size
+        self.__hits = 0
+        self.__misses = 0
+
+        header = None
+        if os.path.exists(path) and os.path.getsize(path) == size:
+            with open(path, "rb") as file:
+                header = self.HEADER.unpack(file.read(self.HEADER.size))
+        self.__file = open(path, "r+b" if header is not None else "w+b")
+        if header is None or header[:4] != (self.MAGIC, self.VERSION, self.__buckets, self.__ways):
+            # A missing file, or one made for a different size or format, is started again empty. Truncating to
+            # nothing first zeroes the old records of a file that was already the right size.
+            self.__file.truncate(0)
+            self.__file.truncate(size)
+            header = (self.MAGIC, self.VERSION, self.__buckets, self.__ways, 0)
+        self.__map = mmap.mmap(self.__file.fileno(), size)
+        self.__counter = header[4]
+        self.HEADER.pack_into(self.__map, 0, *header)
+
+    def __len__(self):
+        used = 0
+        for slot in range(self.__buckets * self.__ways):
+            if self.RECORD.unpack_from(self.__map, self.HEADER.size + slot * self.RECORD.size)[1]:
+                used += 1
+        return used
+
+    # Returns the 64 bit number for one kind of domino, the same in every run.
+    @staticmethod
+    def getDominoKey(code):
+        return int.from_bytes(blake2b(bytes(code), digest_size=8).digest(), "little")
+
+    def __slots(self, fingerprint, end):
+        bucket = ((fingerprint + (end + 1) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) % self.__buckets
+        first = self.HEADER.size + bucket * self.__ways * self.RECORD.size
+        return range(first, first + self.__ways * self.RECORD.size, self.RECORD.size)
+
+    # Returns (pips dots, pips length, longest length, longest dots, pips move, longest move) for the state, with each
+    # move as a (low, high) code or None, or None if the state isn't in the table.
+    def get(self, fingerprint, end):
+        for offset in self.__slots(fingerprint, end):
+            record = self.RECORD.unpack_from(self.__map, offset)
+            if record[0] == fingerprint and record[1] == end + 1:
+                self.__hits += 1
+                self.__counter += 1
+                self.RECORD.pack_into(self.__map, offset, *record[:-1], self.__counter)
+                pipsMove = None if record[6] == 255 else (record[6], record[7])
+                longMove = None if record[8] == 255 else (record[8], record[9])
+                return record[2], record[3], record[4], record[5], pipsMove, longMove
+        self.__misses += 1
+        return None
+
+    def put(self, fingerprint, end, entry):
+        pipsDots, pipsLength, longLength, longDots, pipsMove, longMove = entry
+        self.__counter += 1
+        oldest = None
+        for offset in self.__slots(fingerprint, end):
+            record = self.RECORD.unpack_from(self.__map, offset)
+            if not record[1] or (record[0] == fingerprint and record[1] == end + 1):
+                oldest = offset
+                break
+            if oldest is None or record[-1] < oldestUse:
+                oldest, oldestUse = offset, record[-1]
+        self.RECORD.pack_into(self.__map, oldest, fingerprint, end + 1, pipsDots, pipsLength, longLength, longDots,
+                              *(pipsMove or (255, 255)), *(longMove or (255, 255)), self.__counter)
+
+    # Writes the counter back and closes the file.
+    def close(self):
+        if self.__map.closed:
+            return
+        self.HEADER.pack_into(self.__map, 0, self.MAGIC, self.VERSION, self.__buckets, self.__ways, self.__counter)
+        self.__map.flush()
+        self.__map.close()
+        self.__file.close()
+
+    def getHits(self):
+        return self.__hits
+
+    def getMisses(self):
+        return self.__misses
+
+
+# This is a cache of finished results in front of buildTrain, for players sending the same hand again. A hand is keyed
+# on its dominoes, low number first and sorted, plus the root number, so the order they were read in or the way they
+# were facing doesn't matter. An entry holds the domino pairs of the most pips and longest trains as they were
+# reported, so a hit gives back the same trains without searching.
+# The cache is bounded: once it holds maxSize hands, the least recently used one is dropped. With a path, the entries
+# are loaded from that file and save writes them back, since every run of the executable is a new process. A file that
+# can't be read starts the cache empty. save only rewrites it when an entry was added or dropped, so a hit doesn't cost
+# a write of the whole cache. The hit and miss counts change on every run, so they are kept in a small file of their
+# own next to it, the path plus ".counts", which save writes whenever they changed.
+class ResultCache:
+    def __init__(self, path=None, maxSize=RESULT_CACHE_SIZE):
+        self.__path = path
+        self.__maxSize = maxSize
+        self.__results = OrderedDict()
+        self.__hits = 0
+        self.__misses = 0
+        self.__changed = False
+        self.__countsChanged = False
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, "r") as file:
+                    saved = json.loads(file.read())
+                for key, trains in saved["results"]:
+                    self.__results[key] = tuple(tuple(tuple(pair) for pair in train) for train in trains)
+            except (OSError, ValueError, KeyError, TypeError):
+                self.__results.clear()
+        if path is not None and os.path.exists(path + ".counts"):
+            try:
+                with open(path + ".counts", "r") as file:
+                    saved = json.loads(file.read())
+                self.__hits = saved["hits"]
+                self.__misses = saved["misses"]
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+
+    def __len__(self):
+        return len(self.__results)
+
+    # Returns the key for a hand of domino pairs and a root number.
+    @staticmethod
+    def getKey(tiles, rootNumber):
+        codes = sorted((min(pair), max(pair)) for pair in tiles)
+        return f"{rootNumber}|" + " ".join(f"{low},{high}" for low, high in codes)
+
+    # Returns the most pips and longest trains for the key as new Trains, or None if the hand isn't cached.
+    def get(self, key):
+        trains = self.__results.get(key)
+        self.__countsChanged = True
+        if trains is None:
+            self.__misses += 1
+            return None
+        self.__hits += 1
+        self.__results.move_to_end(key)
+        return tuple(_pairsToTrain(pairs) for pairs in trains)
+
+    def put(self, key, mostPipsTrain, longestTrain):
+        self.__results[key] = (mostPipsTrain.getKey(), longestTrain.getKey())
+        self.__results.move_to_end(key)
+        self.__changed = True
+        while len(self.__results) > self.__maxSize:
+            self.__results.popitem(last=False)
+
+    # Writes the cache and its counts to their files, whichever changed, through a temporary file so a run that stops
+    # part way can't leave half of one.
+    def save(self):
+        if self.__path is None:
+            return
+        if self.__changed:
+            self.__write(self.__path, {"results": [[key, trains] for key, trains in self.__results.items()]})
+            self.__changed = False
+        if self.__countsChanged:
+            self.__write(self.__path + ".counts", {"hits": self.__hits, "misses": self.__misses})
+            self.__countsChanged = False
+
+    @staticmethod
+    def __write(path, saved):
+        with open(path + ".tmp", "w") as file:
+            file.write(json.dumps(saved))
+        os.replace(path + ".tmp", path)
+
+    def clear(self):
+        self.__results.clear()
+        self.__changed = True
+
+    def getHits(self):
+        return self.__hits
+
+    def getMisses(self):
+        return self.__misses
+
+
+# This keeps a plan for a hand that changes one domino at a time during a round, a boneyard draw or a play. The memo
+# table of solved states is kept between plans. A state only depends on which dominoes are left and the open end, so
+# every state solved for the old hand that doesn't use a new domino is still right for the new one:
+#   - Playing a domino on the root takes its bit out of the full mask and moves the root to its other number, see
+#     playDomino. The last plan already solved that state, since it tried every domino on the root, so the new plan is
+#     just read back out of the table. The exception is a domino played while the root's double is still in the hand,
+#     which the search never tries, see DOUBLES_FIRST.
+#   - Removing a domino some other way only takes its bit out of the full mask. The states without it that the last
+#     plan reached are reused, but the new root state usually wasn't one of them, so some of the search runs again.
+#   - Adding a domino gives it an index of its own, or back the index it had if it was in the hand before, and only the
+#     states that still have it left get solved.
+# Indices are never given to a different domino, since that would make the states that use them wrong. A copy of a
+# domino that is already in the hand can only go straight after its other copies, see DominoHand, so if the last index
+# belongs to something else the hand is rebuilt and the table cleared.
+# The plan is read with the memo engine, see __memoSearch.
+class TrainPlanner:
+    def __init__(self, dominoPool=(), rootNumber=0, memoTable=None):
+        self.__rootNumber = rootNumber
+        self.__table = MemoTable() if memoTable is None else memoTable
+        self.__hand = DominoHand(dominoPool)
+        self.__lastNodes = 0
+
+    def __str__(self):
+        return str(self.__hand)
+
+    def __repr__(self):
+        return str(self.__hand)
+
+    def __len__(self):
+        return len(self.__hand)
+
+    def addDomino(self, newDomino):
+        dominoes = self.__hand.getDominoes()
+        fullMask = self.__hand.getFullMask()
+        for index, domino in enumerate(dominoes):
+            if domino == newDomino and not fullMask >> index & 1:
+                self.__hand = DominoHand(dominoes, fullMask | 1 << index)
+                return
+        if newDomino in dominoes and dominoes[-1] != newDomino:
+            self.__table.clear()
+            self.__hand = DominoHand([dominoes[index] for index in _maskIndices(fullMask)] + [newDomino])
+            return
+        self.__hand = DominoHand(dominoes + [newDomino], fullMask | 1 << len(dominoes))
+
+    # Returns False if the domino isn't in the hand.
+    def removeDomino(self, domino):
+        dominoes = self.__hand.getDominoes()
+        fullMask = self.__hand.getFullMask()
+        for index in reversed(_maskIndices(fullMask)):
+            if dominoes[index] == domino:
+                self.__hand = DominoHand(dominoes, fullMask ^ 1 << index)
+                return True
+        return False
+
+    # This plays a domino on the root: it is taken out of the hand and the root moves to its other number. Of copies,
+    # the first one is played, the same one the search plays, so its state is the one already solved.
+    # Returns False if the domino isn't in the hand or can't be played on the root.
+    def playDomino(self, domino):
+        if self.__rootNumber not in domino.getPair():
+            return False
+        dominoes = self.__hand.getDominoes()
+        fullMask = self.__hand.getFullMask()
+        for index in _maskIndices(fullMask):
+            if dominoes[index] == domino:
+                self.__hand = DominoHand(dominoes, fullMask ^ 1 << index)
+                self.__rootNumber = domino.getOtherNumber(self.__rootNumber)
+                return True
+        return False
+
+    def setRootNumber(self, newRootNumber):
+        self.__rootNumber = newRootNumber
+
+    def getRootNumber(self):
+        return self.__rootNumber
+
+    def getHand(self):
+        return self.__hand
 
+    def getMemoTable(self):
+        return self.__table
 
-# This is the main method of this module. Pass a pool of dominos to this method and a number to start the train with
-# and it will return two trains of all the possible ones you could make with the pool of dominos and specified start
-# number: the train with the most dots and the train with the most dominoes.
-# The dominoPool should be a set
-def buildTrain():
+    # Returns the number of states the last plan had to solve.
+    def getLastNodes(self):
+        return self.__lastNodes
+
+    # This method returns the most pips train and the longest train for the hand as it is now.
+    def getPlan(self):
+        collector = TrainCollector()
+        self.__lastNodes = ENGINES["memo"](self.__hand, self.__rootNumber, collector, self.__table)
+        return (self.__hand.makeTrain(collector.getMostPips()[2], self.__rootNumber),
+                self.__hand.makeTrain(collector.getLongest()[2], self.__rootNumber))
+
+
+# This is what solve gives back for a hand: the most pips train, the longest train, whether they are sure to be the
+# best trains, how many nodes or states the engine searched and how many seconds it took, the root number and
+# engine it was solved with, and the search's SearchStats. The engine is "cache" for a result buildTrain took from its
+# ResultCache, which has no stats.
+# toDict gives the result as the versioned JSON format buildTrain writes, RESULT_VERSION, which is:
+#   {"version": 1, "rootNumber": 2, "engine": "memo", "optimal": true, "nodes": 42, "seconds": 0.001,
+#    "mostPips": {"tiles": [[2, 3], [3, 11], [11, 1]], "pips": 31, "length": 3},
+#    "longest": {"tiles": [[2, 3], [3, 0], [0, 0], [0, 9]], "pips": 17, "length": 4},
+#    "stats": {"nodes": 42, "leaves": 9, "pruned": 0, "memoHits": 17, "memoMisses": 42, "maxDepth": 4,
+#              "depthSeconds": []}}
+# Each train's tiles are its dominoes in order, each one facing the way it is played. stats is null without stats.
+class TrainResult:
+    def __init__(self, mostPipsTrain, longestTrain, optimal=True, nodes=0, seconds=0.0, rootNumber=None, engine=None,
+                 stats=None):
+        self.__mostPipsTrain = mostPipsTrain
+        self.__longestTrain = longestTrain
+        self.__optimal = optimal
+        self.__nodes = nodes
+        self.__seconds = seconds
+        self.__rootNumber = rootNumber
+        self.__engine = engine
+        self.__stats = stats
+
+    def __str__(self):
+        return f"Most Pips: {self.__mostPipsTrain}, Longest: {self.__longestTrain}"
+
+    def __repr__(self):
+        return f"Most Pips: {self.__mostPipsTrain}, Longest: {self.__longestTrain}"
+
+    def getMostPips(self):
+        return self.__mostPipsTrain
+
+    def getLongest(self):
+        return self.__longestTrain
+
+    # False if the search stopped before it could be sure, at its deadline or by dropping trains, see __beamSearch.
+    def isOptimal(self):
+        return self.__optimal
+
+    def getNodes(self):
+        return self.__nodes
+
+    def getSeconds(self):
+        return self.__seconds
+
+    def getRootNumber(self):
+        return self.__rootNumber
+
+    def getEngine(self):
+        return self.__engine
+
+    def getStats(self):
+        return self.__stats
+
+    def toDict(self):
+        trains = {}
+        for name, train in (("mostPips", self.__mostPipsTrain), ("longest", self.__longestTrain)):
+            trains[name] = {"tiles": [list(pair) for pair in train.getKey()], "pips": train.getDotCount(),
+                            "length": train.getDominoCount()}
+        return {"version": RESULT_VERSION, "rootNumber": self.__rootNumber, "engine": self.__engine,
+                "optimal": self.__optimal, "nodes": self.__nodes, "seconds": self.__seconds, **trains,
+                "stats": self.__stats.toDict() if self.__stats is not None else None}
+
+
+# This is the solver on its own, for calling in process, like from a web worker that stays up between hands. The
+# tiles are the hand's Dominoes or (top, bottom) pairs in any order, or a DominoHand that is used as it is. It reads
+# and writes no files and doesn't look at the environment, everything it uses comes in through its arguments. Any
+# other options are passed on to the engine, like a deadline or a memoTable or transpositionTable kept between calls.
+# The search is counted into a new SearchStats unless one is passed as stats.
+# When two trains tie on dots the longer one wins, and when two trains tie on length the one with more dots wins.
+# Returns a TrainResult.
+def solve(tiles, rootNumber, engine="bitmask", **options):
+    if isinstance(tiles, DominoHand):
+        dominoHand = tiles
+    else:
+        dominoHand = __buildPool(tile.getPair() if isinstance(tile, Domino) else tile for tile in tiles)
+    collector = TrainCollector()
+    stats = options.setdefault("stats", SearchStats())
+    startTime = time.perf_counter()
+    nodes = ENGINES[engine](dominoHand, rootNumber, collector, **options)
+    seconds = time.perf_counter() - startTime
+    return TrainResult(dominoHand.makeTrain(collector.getMostPips()[2], rootNumber),
+                       dominoHand.makeTrain(collector.getLongest()[2], rootNumber),
+                       collector.isComplete(), nodes, seconds, rootNumber, engine, stats)
+
+
+# This is the main method of this module, and what the executable runs. It reads the hand and root number the image
+# processor and web app wrote, solves it with solve and writes the result to TRAIN_BUILDER_OUTPUT_PATH as JSON, see
+# TrainResult: the train with the most dots and the train with the most dominoes. The file is written through a
+# temporary file, so the web app waiting for it never reads half of one. The paths and settings come from
+# loadEnvironment.
+# The search engine is picked by name from ENGINES, by default from TRAIN_BUILDER_ENGINE in the environment. Any other
+# options are passed on to the engine. If TRAIN_BUILDER_TABLE_PATH is set, the memo engine keeps its solved states in
+# a TranspositionTable file there for the next run. If TRAIN_BUILDER_CACHE_PATH is set, a hand that was solved before
+# is answered from the ResultCache file there instead of searching again. If TRAIN_BUILDER_DEADLINE is set, the engine
+# only searches for that many seconds and the best trains found by then are reported. Those aren't cached, since they
+# may not be the best. Each search is logged as one line of JSON with its engine, size, time and SearchStats, so the
+# log can be read back to find the hands that take the longest.
+# Returns the TrainResult.
+def buildTrain(engine=None, **options):
     # CODE
+    engine = engine or trainEngine
     rootNumber = __getRootNumber()
     rawDominoes = __extractDominoes()
-    dominoPool = __buildPool(rawDominoes)
+    dominoHand = __buildPool(rawDominoes.values())
 
     # INFO LOGGING
     logger.info("BEGIN BUILDTRAIN".center(40, '='))
     logger.info("---STARTING INFO---")
-    logger.info(f"pool: {dominoPool}")
-    rootDominoPool = _findRootDominos(dominoPool, rootNumber)
+    logger.info(f"pool: {dominoHand.getDominoes()}")
+    rootTiles = dominoHand.getRootTiles(dominoHand.getFullMask(), rootNumber)
+    rootDominoPool = [dominoHand.getTiles()[index] for index in rootTiles]
     logger.info(f"root num: {rootNumber}, root dominos: {rootDominoPool}")
     logger.info("")
 
     # CODE
-    allTrains = __buildTrain_helper(dominoPool, rootNumber, Train(), set())
-    allTrains = sorted(list(allTrains), key=lambda x: x.getDotCount(), reverse=True)
-    finalTrain = allTrains[0]
-    longestTrain = _findLongestTrain(allTrains)
+    resultCache = ResultCache(resultCachePath) if resultCachePath else None
+    cacheKey = ResultCache.getKey(dominoHand.getTiles(), rootNumber)
+    cached = resultCache.get(cacheKey) if resultCache is not None else None
+    if cached is not None:
+        result = TrainResult(*cached, rootNumber=rootNumber, engine="cache")
+        logger.info(f"---CACHED RESULT, {resultCache.getHits()} HITS, {resultCache.getMisses()} MISSES---")
+    else:
+        transpositionTable = None
+        if transpositionTablePath and engine == "memo" and "transpositionTable" not in options:
+            transpositionTable = options["transpositionTable"] = TranspositionTable(transpositionTablePath)
+        if searchDeadline:
+            options.setdefault("deadline", float(searchDeadline))
+        try:
+            result = solve(dominoHand, rootNumber, engine, **options)
+        finally:
+            if transpositionTable is not None:
+                transpositionTable.close()
+        logger.info(f"---SEARCHED {result.getNodes()} NODES IN {result.getSeconds():.3f} SECONDS---")
+        logger.info(json.dumps({"engine": engine, "rootNumber": rootNumber, "dominoes": len(dominoHand.getTiles()),
+                                "optimal": result.isOptimal(), "seconds": round(result.getSeconds(), 6),
+                                "stats": result.getStats().toDict()}))
+        if not result.isOptimal():
+            logger.info("---STOPPED AT THE DEADLINE, BEST TRAINS FOUND SO FAR---")
+    finalTrain, longestTrain = result.getMostPips(), result.getLongest()
+    if resultCache is not None:
+        if cached is None and result.isOptimal():
+            resultCache.put(cacheKey, finalTrain, longestTrain)
+        resultCache.save()
 
     # INFO LOGGING
     logger.info(f"---HIGHEST DOT COUNT TRAIN, COUNT: {finalTrain.getDotCount()}---")
@@ -174,24 +1089,782 @@ def buildTrain():
     logger.info("END BUILDTRAIN".center(40, '='))
     logging.info("\n")
 
-    with open(finalOutputPath, "w+") as file:
-        print("Most Pips:\t" + f"{finalTrain}", file=file)
-        print("Longest:\t" + f"{longestTrain}", file=file)
+    with open(finalOutputPath + ".tmp", "w") as file:
+        file.write(json.dumps(result.toDict()))
+    os.replace(finalOutputPath + ".tmp", finalOutputPath)
     # CODE
-    return finalTrain, longestTrain
+    return result
+
+
+# This function finds the k best trains for one objective, "pips" or "longest", instead of just the one best train.
+# The hand can be a DominoHand or any pool of Dominoes. The trains are kept in a bounded heap while the search runs,
+# so it costs O(log k) per train found instead of sorting every train at the end. Only the engines that offer every
+# train can fill a top K, so the engine is "bitmask", "stack" or "parallel".
+# Returns a list of (dot count, domino count, train), best first.
+# Mostly internal but could have an external use
+def topK(hand, rootNumber, k, objective="pips", engine="bitmask", **options):
+    if engine not in ("bitmask", "stack", "parallel"):
+        raise ValueError(f"The {engine} engine can't fill a top K")
+    dominoHand = hand if isinstance(hand, DominoHand) else DominoHand(hand)
+    collector = TrainCollector(k, objective=objective)
+    ENGINES[engine](dominoHand, rootNumber, collector, **options)
+    return [(dotCount, dominoCount, dominoHand.makeTrain(path, rootNumber))
+            for dotCount, dominoCount, path in collector.getTopTrains()]
+
+
+# This function finds the Pareto frontier of dots against length in one search: for each length on it, the train with
+# the most dots, where each shorter train on it has more dots than the longer ones. The first entry is the most pips
+# train and the last is the longest train, so strategy can pick anything in between. Like topK it needs an engine
+# that offers every train, "bitmask", "stack" or "parallel".
+# Returns a list of (dot count, domino count, train), shortest first.
+# Mostly internal but could have an external use
+def paretoFrontier(hand, rootNumber, engine="bitmask", **options):
+    if engine not in ("bitmask", "stack", "parallel"):
+        raise ValueError(f"The {engine} engine can't find a frontier")
+    dominoHand = hand if isinstance(hand, DominoHand) else DominoHand(hand)
+    collector = TrainCollector(frontier=True)
+    ENGINES[engine](dominoHand, rootNumber, collector, **options)
+    return [(dotCount, dominoCount, dominoHand.makeTrain(path, rootNumber))
+            for dotCount, dominoCount, path in collector.getFrontier()]
+
+
+# This function reports how far the beam search falls from the exact answer on a hand, for picking a width. The hand
+# has to be small enough for the memo engine to solve exactly.
+# Returns how many dots the beam's most pips train is short of the best one and how many dominoes its longest train is
+# short of the longest one, both 0 when the beam found the best trains.
+# Mostly internal but could have an external use
+def beamGap(hand, rootNumber, width=BEAM_WIDTH):
+    dominoHand = hand if isinstance(hand, DominoHand) else DominoHand(hand)
+    exact = TrainCollector()
+    ENGINES["memo"](dominoHand, rootNumber, exact)
+    beam = TrainCollector()
+    ENGINES["beam"](dominoHand, rootNumber, beam, width)
+    pipsGap = exact.getMostPips()[0] - beam.getMostPips()[0]
+    lengthGap = exact.getLongest()[1] - beam.getLongest()[1]
+    logger.info(f"beam width {width}: {pipsGap} dots and {lengthGap} dominoes short")
+    return pipsGap, lengthGap
+
+
+# This function finds the best trains for every root number at once, for looking at a hand before the round's number
+# is known. The engine is "memo" or "graph", and one memo table is used for every root.
+# The roots can't share solved states though. A state is the dominoes left and the open end, and the dominoes played
+# to get there form a trail from the root to the open end. That trail has an odd number of dominoes on the root and
+# the open end and an even number everywhere else, unless they are the same number, so the same dominoes played with
+# the same open end always came from the same root. The table is cleared between roots instead of letting states that
+# can't be used again push out ones that can.
+# Returns a dictionary from each root number to its (most pips train, longest train).
+# Mostly internal but could have an external use
+def buildAllTrains(hand, roots=range(MAX_PIP + 1), engine="memo"):
+    if engine not in ("memo", "graph"):
+        raise ValueError(f"The {engine} engine doesn't keep a memo table")
+    dominoHand = hand if isinstance(hand, DominoHand) else DominoHand(hand)
+    memoTable = MemoTable()
+    allTrains = {}
+    for rootNumber in roots:
+        collector = TrainCollector()
+        ENGINES[engine](dominoHand, rootNumber, collector, memoTable)
+        memoTable.clear()
+        allTrains[rootNumber] = (dominoHand.makeTrain(collector.getMostPips()[2], rootNumber),
+                                 dominoHand.makeTrain(collector.getLongest()[2], rootNumber))
+    return allTrains
+
+
+# This is the search engine behind buildTrain. It walks the same tree as __buildTrain_helper, but on an indexed hand:
+# the remaining pool is a bitmask and the train being built is a list of domino indices, so no sets or Domino objects
+# are created while searching. The playable dominoes at each step come straight from the hand's pip index instead of a
+# scan of the whole pool. Every complete train is offered to the collector as a path, see _pathIndices.
+# With prune set, each step with more than one domino to choose from checks the most dots and dominoes the train could
+# still gain. If even that can't beat anything the collector is keeping, the branch is skipped. The result is the same,
+# only trains that could never be kept are not searched. The bound is the parent's bound minus the domino played,
+# tightened with getReachableBound, which drops the dominoes that can no longer be reached. That walks the pip's
+# component, so it is kept per (dominoes left, open end) state, which the search reaches again and again in different
+# orders. A step with a single domino isn't checked, the next step that has a choice checks the same bound.
+# Checking costs a little on every step and only pays off on the hands where the kept trains reach their bound early,
+# like hands on a handful of pips: a 25 domino one went from 3.7 million nodes in 6s to 5814 nodes in 0.02s, while
+# a random 25 domino double-12 hand where the bound cuts less took about 8% longer.
+# A prefix, a list of domino indices, can be given to only search the trains that start with those dominoes.
+# Unless the collector keeps a top K, a double is always played as soon as its pip is open, see DOUBLES_FIRST.
+# With a deadline, in seconds, the search stops once it runs out of time and marks the collector incomplete, leaving
+# the best trains found so far in it. The search reaches complete trains straight away and __buildPool puts the
+# dominoes with the most dots first, so those first trains are greedy ones and usually good.
+# Pass a SearchStats to have the search's counters added to it, every engine takes one.
+# Returns the number of nodes searched.
+# Internal use only.
+def __searchTrains(dominoHand, rootNumber, collector, prune=False, prefix=(), deadline=None, stats=None):
+    tiles = dominoHand.getTiles()
+    dots = dominoHand.getDots()
+    pipMasks = dominoHand.getPipMasks()
+    doubleMasks = dominoHand.getDoubleMasks()
+    copyMask = dominoHand.getCopyMask()
+    doublesFirst = DOUBLES_FIRST and collector.getTopK() == 0
+    reachableBound = dominoHand.getReachableBound
+    canImprove = collector.canImprove
+    offer = collector.offer
+    stopTime = None if deadline is None else time.monotonic() + deadline
+    checkClock = stopTime is not None or stats is not None
+    bounds = {}
+    nodes = leaves = pruned = maxDepth = 0
+
+    def search(mask, end, dotCount, dotsLeft, dominosLeft, path, length):
+        nonlocal nodes, leaves, pruned, maxDepth
+        nodes += 1
+        if checkClock and not nodes & DEADLINE_CHECK:
+            now = time.monotonic()
+            if stats is not None:
+                stats.sample(length, now)
+            if stopTime is not None and now > stopTime:
+                raise _SearchTimeout
+        rest = mask & pipMasks[end] & ~(mask << 1 & copyMask)
+        if rest:
+            if doublesFirst and rest & doubleMasks[end]:
+                rest &= doubleMasks[end]
+                rest &= -rest
+            if prune and rest & (rest - 1):
+                key = mask << 5 | end
+                bound = bounds.get(key)
+                if bound is None:
+                    if len(bounds) >= BOUND_CACHE_SIZE:
+                        bounds.clear()
+                    bound = bounds[key] = reachableBound(mask, end)
+                if bound[0] < dotsLeft:
+                    dotsLeft = bound[0]
+                if bound[1] < dominosLeft:
+                    dominosLeft = bound[1]
+                if not canImprove(dotCount + dotsLeft, length + dominosLeft):
+                    pruned += 1
+                    return
+            while rest:
+                bit = rest & -rest
+                rest ^= bit
+                index = bit.bit_length() - 1
+                top, bottom = tiles[index]
+                search(mask ^ bit, bottom if top == end else top, dotCount + dots[index],
+                       dotsLeft - dots[index], dominosLeft - 1, (path, index), length + 1)
+        else:
+            offer(dotCount, length, path)
+            leaves += 1
+            if length > maxDepth:
+                maxDepth = length
+
+    if 0 <= rootNumber < len(pipMasks):
+        mask = dominoHand.getFullMask()
+        dotsLeft, dominosLeft = reachableBound(mask, rootNumber)
+        end = rootNumber
+        dotCount = 0
+        path = None
+        for index in prefix:
+            top, bottom = tiles[index]
+            mask ^= 1 << index
+            end = bottom if top == end else top
+            dotCount += dots[index]
+            dotsLeft -= dots[index]
+            dominosLeft -= 1
+            path = (path, index)
+        try:
+            search(mask, end, dotCount, dotsLeft, dominosLeft, path, len(prefix))
+        except _SearchTimeout:
+            collector.markIncomplete()
+    else:
+        offer(0, 0, None)
+    if stats is not None:
+        stats.add(nodes, leaves, pruned, maxDepth=maxDepth)
+    return nodes
+
+
+# This is the explicit stack search engine. It searches the same tree as __searchTrains without recursion, so the
+# depth is only limited by the hand and no Python frame is made per node. The node being searched lives in local
+# variables: the dominoes left, the open end, the dots so far, the dominoes still to try and the bound on what can
+# still be gained. Going deeper pushes one tuple to resume the node from and going back pops it and undoes the
+# domino's bit and dots, so each step costs one tuple and no indexing into per-depth lists.
+# The trains are offered to a collector of its own with a snapshot that builds the path from the stack, so a path is
+# only made for a train that is kept. That collector is merged into the one passed in at the end.
+# prune, deadline and stats work as in __searchTrains.
+# Returns the number of nodes searched.
+# Internal use only.
+def __stackSearch(dominoHand, rootNumber, collector, prune=False, deadline=None, stats=None):
+    tiles = dominoHand.getTiles()
+    dots = dominoHand.getDots()
+    pipMasks = dominoHand.getPipMasks()
+    doubleMasks = dominoHand.getDoubleMasks()
+    copyMask = dominoHand.getCopyMask()
+    doublesFirst = DOUBLES_FIRST and collector.getTopK() == 0
+    if not 0 <= rootNumber < len(pipMasks):
+        collector.offer(0, 0, None)
+        return 0
+
+    # (dominoes still to try, open end, domino played from there, dots bound, dominoes bound) for each depth above
+    stack = []
+
+    def snapshot(_):
+        path = None
+        for frame in stack:
+            path = (path, frame[2])
+        return path
+
+    stackCollector = TrainCollector(collector.getTopK(), snapshot, collector.getObjective(), collector.hasFrontier())
+    reachableBound = dominoHand.getReachableBound
+    canImprove = stackCollector.canImprove
+    offer = stackCollector.offer
+    push = stack.append
+    pop = stack.pop
+    stopTime = None if deadline is None else time.monotonic() + deadline
+    checkClock = stopTime is not None or stats is not None
+    bounds = {}
+
+    mask = dominoHand.getFullMask()
+    end = rootNumber
+    dotCount = length = 0
+    dotsLeft, dominosLeft = reachableBound(mask, rootNumber)
+    nodes = pruned = maxDepth = 0
+    rest = None
+    while True:
+        if rest is None:
+            # A new node: find its moves, or offer its train if there are none
+            nodes += 1
+            if checkClock and not nodes & DEADLINE_CHECK:
+                now = time.monotonic()
+                if stats is not None:
+                    stats.sample(length, now)
+                if stopTime is not None and now > stopTime:
+                    stackCollector.markIncomplete()
+                    break
+            rest = mask & pipMasks[end] & ~(mask << 1 & copyMask)
+            if not rest:
+                offer(dotCount, length, None)
+                if length > maxDepth:
+                    maxDepth = length
+            else:
+                if doublesFirst and rest & doubleMasks[end]:
+                    rest &= doubleMasks[end]
+                    rest &= -rest
+                if prune and rest & (rest - 1):
+                    key = mask << 5 | end
+                    bound = bounds.get(key)
+                    if bound is None:
+                        if len(bounds) >= BOUND_CACHE_SIZE:
+                            bounds.clear()
+                        bound = bounds[key] = reachableBound(mask, end)
+                    if bound[0] < dotsLeft:
+                        dotsLeft = bound[0]
+                    if bound[1] < dominosLeft:
+                        dominosLeft = bound[1]
+                    if not canImprove(dotCount + dotsLeft, length + dominosLeft):
+                        rest = 0
+                        pruned += 1
+
+        if rest:
+            # Play the next domino from this node
+            bit = rest & -rest
+            index = bit.bit_length() - 1
+            push((rest ^ bit, end, index, dotsLeft, dominosLeft))
+            top, bottom = tiles[index]
+            mask ^= bit
+            dotCount += dots[index]
+            dotsLeft -= dots[index]
+            dominosLeft -= 1
+            length += 1
+            end = bottom if top == end else top
+            rest = None
+        elif stack:
+            # Nothing left to try here, go back to the node before and undo the domino that led here
+            rest, end, index, dotsLeft, dominosLeft = pop()
+            mask ^= 1 << index
+            dotCount -= dots[index]
+            length -= 1
+        else:
+            break
+
+    collector.merge(stackCollector)
+    if stats is not None:
+        stats.add(nodes, stackCollector.getTrainCount(), pruned, maxDepth=maxDepth)
+    return nodes
+
+
+# This is the memoised search engine. Instead of walking every ordering of the dominoes, it solves each search state,
+# (dominoes left, open end), once and stores the best way to finish from it in a MemoTable. Every ordering that reaches
+# the same state then reuses that answer, which turns the factorial number of orderings into the much smaller number
+# of states. Each entry holds the best (dots, length) to finish with the most pips, the best (length, dots) to finish
+# with the most dominoes and the domino to play next for each, so the two trains can be read back out of the table.
+# Only the most pips and longest trains are offered to the collector, this engine can't fill a top K. Doubles are
+# played as soon as their pip is open, see DOUBLES_FIRST.
+# Pass a MemoTable to keep the solved states for later searches on the same hand, and a TranspositionTable to share
+# them with later runs and other hands holding the same dominoes.
+# With a deadline, in seconds, the search stops once it runs out of time and marks the collector incomplete. Nothing
+# is known about the best trains until the first state is solved, so the greedy train is offered instead, see
+# _greedyPath. The states solved by then are kept in the tables and are still right. stats works as in __searchTrains,
+# a state's depth being how many dominoes were played to reach it.
+# Returns the number of states solved.
+# Internal use only.
+def __memoSearch(dominoHand, rootNumber, collector, memoTable=None, transpositionTable=None, deadline=None,
+                 stats=None):
+    tiles = dominoHand.getTiles()
+    dots = dominoHand.getDots()
+    pipMasks = dominoHand.getPipMasks()
+    doubleMasks = dominoHand.getDoubleMasks() if DOUBLES_FIRST else [0] * len(pipMasks)
+    copyMask = dominoHand.getCopyMask()
+    table = MemoTable() if memoTable is None else memoTable
+    stopTime = None if deadline is None else time.monotonic() + deadline
+    checkClock = stopTime is not None or stats is not None
+    fullCount = bin(dominoHand.getFullMask()).count("1")
+    tableHits = table.getHits() + (transpositionTable.getHits() if transpositionTable is not None else 0)
+    nodes = leaves = maxDepth = 0
+
+    if transpositionTable is not None:
+        # Sums of the domino keys for every byte of a mask, so a fingerprint is one lookup per 8 dominoes
+        codes = [(min(pair), max(pair)) for pair in tiles]
+        codeMasks = {}
+        byteSums = []
+        for index, code in enumerate(codes):
+            codeMasks[code] = codeMasks.get(code, 0) | 1 << index
+            if index % 8 == 0:
+                byteSums.append([0] * 256)
+            sums = byteSums[-1]
+            dominoKey = TranspositionTable.getDominoKey(code)
+            bit = 1 << index % 8
+            for byte in range(bit, bit << 1):
+                sums[byte] = sums[byte ^ bit] + dominoKey
 
+    def getFingerprint(mask):
+        fingerprint = 0
+        for sums in byteSums:
+            fingerprint += sums[mask & 255]
+            mask >>= 8
+        return fingerprint & 0xFFFFFFFFFFFFFFFF
 
-# This is the helper method to the main method. This builds and returns all possible trains with the specified starting
-# number and domino pool.
+    # Turns a move stored as a domino's numbers back into an index in this hand, -2 if it can't be played here
+    def getMoveIndex(mask, end, move):
+        if move is None:
+            return -1
+        playable = mask & codeMasks.get(move, 0) & ~(mask << 1 & copyMask)
+        if end not in move or not playable:
+            return -2
+        return (playable & -playable).bit_length() - 1
+
+    def solve(mask, end):
+        nonlocal nodes, leaves, maxDepth
+        key = mask << 5 | end
+        entry = table.get(key)
+        if entry is not None:
+            return entry
+        if transpositionTable is not None:
+            fingerprint = getFingerprint(mask)
+            stored = transpositionTable.get(fingerprint, end)
+            if stored is not None:
+                pipsTile = getMoveIndex(mask, end, stored[4])
+                longTile = getMoveIndex(mask, end, stored[5])
+                if pipsTile != -2 and longTile != -2:
+                    entry = stored[:4] + (pipsTile, longTile)
+                    table.put(key, entry)
+                    return entry
+        nodes += 1
+        if checkClock and not nodes & DEADLINE_CHECK:
+            now = time.monotonic()
+            if stats is not None:
+                stats.sample(fullCount - bin(mask).count("1"), now)
+            if stopTime is not None and now > stopTime:
+                raise _SearchTimeout
+        pipsDots = pipsLength = longLength = longDots = 0
+        pipsTile = longTile = -1
+        rest = mask & pipMasks[end] & ~(mask << 1 & copyMask)
+        if not rest:
+            leaves += 1
+            maxDepth = max(maxDepth, fullCount - bin(mask).count("1"))
+        if rest & doubleMasks[end]:
+            rest &= doubleMasks[end]
+            rest &= -rest
+        while rest:
+            bit = rest & -rest
+            rest ^= bit
+            index = bit.bit_length() - 1
+            top, bottom = tiles[index]
+            child = solve(mask ^ bit, bottom if top == end else top)
+            dotCount = dots[index] + child[0]
+            length = child[1] + 1
+            if dotCount > pipsDots or (dotCount == pipsDots and length > pipsLength):
+                pipsDots, pipsLength, pipsTile = dotCount, length, index
+            length = child[2] + 1
+            dotCount = dots[index] + child[3]
+            if length > longLength or (length == longLength and dotCount > longDots):
+                longLength, longDots, longTile = length, dotCount, index
+        entry = (pipsDots, pipsLength, longLength, longDots, pipsTile, longTile)
+        table.put(key, entry)
+        if transpositionTable is not None:
+            transpositionTable.put(fingerprint, end, entry[:4] + (codes[pipsTile] if pipsTile >= 0 else None,
+                                                                   codes[longTile] if longTile >= 0 else None))
+        return entry
+
+    # Follows the stored choices from the root to rebuild the best path for one goal. A state that was dropped from the
+    # table is just solved again.
+    def readPath(goal):
+        path = None
+        mask = dominoHand.getFullMask()
+        end = rootNumber
+        index = solve(mask, end)[goal]
+        while index >= 0:
+            path = (path, index)
+            top, bottom = tiles[index]
+            mask ^= 1 << index
+            end = bottom if top == end else top
+            index = solve(mask, end)[goal]
+        return path
+
+    # The hits are counted when the search itself is done, reading the trains back out only looks up states it solved
+    def getHits():
+        return table.getHits() + (transpositionTable.getHits() if transpositionTable is not None else 0) - tableHits
+
+    def addStats(hits):
+        if stats is not None:
+            stats.add(nodes, leaves, memoHits=hits, memoMisses=nodes, maxDepth=maxDepth)
+
+    if not 0 <= rootNumber < len(pipMasks):
+        collector.offer(0, 0, None)
+        return nodes
+    try:
+        entry = solve(dominoHand.getFullMask(), rootNumber)
+    except _SearchTimeout:
+        collector.markIncomplete()
+        collector.offer(*_greedyPath(dominoHand, rootNumber))
+        addStats(getHits())
+        return nodes
+    hits = getHits()
+    stopTime = None
+    checkClock = False
+    collector.offer(entry[0], entry[1], readPath(4))
+    collector.offer(entry[3], entry[2], readPath(5))
+    addStats(hits)
+    return nodes
+
+
+# This is the parallel search engine. It splits the search tree at its first level, or its first two levels if there
+# are fewer first dominoes than workers, and searches each subtree with __searchTrains in its own process. The split
+# plays open doubles first like __searchTrains does. Each process fills its own TrainCollector and they are merged into
+# the collector passed in afterwards. workers defaults to the number of CPUs. A deadline, in seconds, holds for the
+# whole search: subtrees that start late get what is left of it, and the ones still waiting for a worker once it has
+# passed are dropped. The workers' stats are merged into stats too, if it is passed.
+# Returns the number of nodes searched across all processes.
+# Internal use only.
+def __parallelSearch(dominoHand, rootNumber, collector, workers=None, prune=False, deadline=None, stats=None):
+    stopTime = None if deadline is None else time.monotonic() + deadline
+    workers = workers or os.cpu_count() or 1
+    if not 0 <= rootNumber < len(dominoHand.getPipMasks()):
+        collector.offer(0, 0, None)
+        return 0
+
+    # Trains that stop before the split are offered here, everything else becomes a prefix for a worker
+    tiles = dominoHand.getTiles()
+    doublesFirst = DOUBLES_FIRST and collector.getTopK() == 0
+    nodes = 1
+    splitLeaves = splitDepth = 0
+    prefixes = []
+    rootTiles = dominoHand.getRootTiles(dominoHand.getFullMask(), rootNumber, doublesFirst)
+    if not rootTiles:
+        collector.offer(0, 0, None)
+        splitLeaves += 1
+    for index in rootTiles:
+        if len(rootTiles) >= workers:
+            prefixes.append([index])
+            continue
+        nodes += 1
+        top, bottom = tiles[index]
+        nextTiles = dominoHand.getRootTiles(dominoHand.getFullMask() ^ 1 << index, bottom if top == rootNumber else top,
+                                            doublesFirst)
+        if not nextTiles:
+            collector.offer(dominoHand.getDots()[index], 1, (None, index))
+            splitLeaves += 1
+            splitDepth = 1
+        prefixes.extend([index, nextIndex] for nextIndex in nextTiles)
+    splitNodes = nodes
+
+    with ProcessPoolExecutor(max_workers=min(workers, max(len(prefixes), 1))) as executor:
+        futures = [executor.submit(_searchSubtree, tiles, rootNumber, prefix, collector.getTopK(), prune,
+                                   collector.getObjective(), collector.hasFrontier(), stopTime, stats is not None)
+                   for prefix in prefixes]
+        for future in futures:
+            if stopTime is not None and time.monotonic() > stopTime and future.cancel():
+                collector.markIncomplete()
+                continue
+            subtreeNodes, subtreeCollector, subtreeStats = future.result()
+            nodes += subtreeNodes
+            collector.merge(subtreeCollector)
+            if stats is not None:
+                stats.merge(subtreeStats)
+    if stats is not None:
+        stats.add(splitNodes, splitLeaves, maxDepth=splitDepth)
+    return nodes
+
+
+# This searches one subtree for __parallelSearch in a worker process. The hand is rebuilt from its pairs, which keeps
+# the same indices, and the worker's collector is sent back whole. stopTime is the time.monotonic() the whole search
+# has to stop by, which is the same clock in every process on the machine. A subtree that starts after it isn't
+# searched at all. With withStats the subtree's SearchStats are sent back too, otherwise None is.
+# Mostly internal but could have an external use
+def _searchSubtree(tiles, rootNumber, prefix, topK=0, prune=False, objective="pips", frontier=False, stopTime=None,
+                   withStats=False):
+    collector = TrainCollector(topK, objective=objective, frontier=frontier)
+    stats = SearchStats() if withStats else None
+    deadline = None if stopTime is None else stopTime - time.monotonic()
+    if deadline is not None and deadline <= 0:
+        collector.markIncomplete()
+        return 0, collector, stats
+    nodes = __searchTrains(DominoHand(Domino(top, bottom) for top, bottom in tiles), rootNumber, collector, prune,
+                           prefix, deadline, stats)
+    return nodes, collector, stats
+
+
+# This is the graph search engine. A train is a trail in a graph whose vertices are the pip values and whose edges are
+# the dominoes, a double being an edge from a pip back to itself. Like __memoSearch it solves each (dominoes left, open
+# pip) state once, and it also carries the total dots, the number and the odd pips of the dominoes left down the search,
+# updating them as each domino is played instead of counting them again at every state.
+# Those totals do two things at a state with more than one move, a state with a single move just plays it:
+#   - A trail has an odd number of edges on a pip only where it starts and ends, so every other odd pip needs an edge
+#     left out and one left out edge fixes at most two of them. That bounds every move before it is searched, and a
+#     move that can't beat the best move already found at that state is skipped.
+#   - If no edge has to be left out and every domino left is reachable from the pip, there is a trail that uses all of
+#     them, which is the best finish for both dots and length. It is built with Hierholzer's algorithm instead of
+#     being searched. The component is only worked out when the parity already allows this.
+# Moves are tried in index order, which __buildPool makes most dots first, so the best move at a state tends to be
+# found before the ones it can skip. A double is an edge from a pip to itself, so it is taken as soon as its pip is
+# open, see DOUBLES_FIRST.
+# Only the most pips and longest trains are offered to the collector, this engine can't fill a top K. A deadline and
+# stats work as in __memoSearch, the moves skipped by the bound are counted as pruned and a trail built with
+# Hierholzer's algorithm as a leaf.
+# Returns the number of states solved.
+# Internal use only.
+def __trailSearch(dominoHand, rootNumber, collector, memoTable=None, deadline=None, stats=None):
+    tiles = dominoHand.getTiles()
+    dots = dominoHand.getDots()
+    pipMasks = dominoHand.getPipMasks()
+    doubleMasks = dominoHand.getDoubleMasks() if DOUBLES_FIRST else [0] * len(pipMasks)
+    copyMask = dominoHand.getCopyMask()
+    getComponent = dominoHand.getComponent
+    table = MemoTable() if memoTable is None else memoTable
+    stopTime = None if deadline is None else time.monotonic() + deadline
+    checkClock = stopTime is not None or stats is not None
+    fullCount = bin(dominoHand.getFullMask()).count("1")
+    tableHits = table.getHits()
+    nodes = leaves = pruned = maxDepth = 0
+
+    # dotsLeft, edgesLeft and oddPips are the total dots, the number and the odd pips of all the dominoes in the mask
+    def solve(mask, pip, dotsLeft, edgesLeft, oddPips):
+        nonlocal nodes, leaves, pruned, maxDepth
+        key = mask << 5 | pip
+        entry = table.get(key)
+        if entry is not None:
+            return entry
+        nodes += 1
+        if checkClock and not nodes & DEADLINE_CHECK:
+            now = time.monotonic()
+            if stats is not None:
+                stats.sample(fullCount - edgesLeft, now)
+            if stopTime is not None and now > stopTime:
+                raise _SearchTimeout
+        playable = mask & pipMasks[pip] & ~(mask << 1 & copyMask)
+        if not playable:
+            leaves += 1
+            maxDepth = max(maxDepth, fullCount - edgesLeft)
+        if playable & doubleMasks[pip]:
+            playable &= doubleMasks[pip]
+            playable &= -playable
+        branching = playable & (playable - 1)
+        if branching and not _leftOutCount(oddPips, pip) and getComponent(mask, pip)[0] == mask:
+            leaves += 1
+            maxDepth = fullCount
+            entry = (dotsLeft, edgesLeft, edgesLeft, dotsLeft, EULER_FINISH, EULER_FINISH)
+            table.put(key, entry)
+            return entry
+
+        pipsDots = pipsLength = longLength = longDots = 0
+        pipsTile = longTile = -1
+        while playable:
+            bit = playable & -playable
+            playable ^= bit
+            index = bit.bit_length() - 1
+            top, bottom = tiles[index]
+            other = bottom if top == pip else top
+            childMask = mask ^ bit
+            childOddPips = oddPips ^ 1 << top ^ 1 << bottom
+            child = table.get(childMask << 5 | other) if branching else None
+            if child is None:
+                if branching:
+                    boundLength = edgesLeft - _leftOutCount(childOddPips, other)
+                    if (dotsLeft < pipsDots or (dotsLeft == pipsDots and boundLength <= pipsLength)) and \
+                            (boundLength < longLength or (boundLength == longLength and dotsLeft <= longDots)):
+                        pruned += 1
+                        continue
+                child = solve(childMask, other, dotsLeft - dots[index], edgesLeft - 1, childOddPips)
+            dotCount = dots[index] + child[0]
+            length = child[1] + 1
+            if dotCount > pipsDots or (dotCount == pipsDots and length > pipsLength):
+                pipsDots, pipsLength, pipsTile = dotCount, length, index
+            length = child[2] + 1
+            dotCount = dots[index] + child[3]
+            if length > longLength or (length == longLength and dotCount > longDots):
+                longLength, longDots, longTile = length, dotCount, index
+        entry = (pipsDots, pipsLength, longLength, longDots, pipsTile, longTile)
+        table.put(key, entry)
+        return entry
+
+    # Works out what solve is given about a mask from scratch, for the states the search starts from
+    def getTotals(mask):
+        dotsLeft = edgesLeft = oddPips = 0
+        for index in _maskIndices(mask):
+            top, bottom = tiles[index]
+            dotsLeft += dots[index]
+            edgesLeft += 1
+            oddPips ^= 1 << top ^ 1 << bottom
+        return dotsLeft, edgesLeft, oddPips
+
+    # Follows the stored choices from the root to rebuild the best path for one goal
+    def readPath(goal):
+        path = None
+        mask = dominoHand.getFullMask()
+        pip = rootNumber
+        index = solve(mask, pip, *getTotals(mask))[goal]
+        while index >= 0:
+            path = (path, index)
+            top, bottom = tiles[index]
+            mask ^= 1 << index
+            pip = bottom if top == pip else top
+            index = solve(mask, pip, *getTotals(mask))[goal]
+        if index == EULER_FINISH:
+            for index in dominoHand.getEulerTrail(getComponent(mask, pip)[0], pip):
+                path = (path, index)
+        return path
+
+    # The hits are counted when the search itself is done, as in __memoSearch
+    def addStats(hits):
+        if stats is not None:
+            stats.add(nodes, leaves, pruned, hits, nodes, maxDepth)
+
+    if not 0 <= rootNumber < len(pipMasks):
+        collector.offer(0, 0, None)
+        return nodes
+    try:
+        entry = solve(dominoHand.getFullMask(), rootNumber, *getTotals(dominoHand.getFullMask()))
+    except _SearchTimeout:
+        collector.markIncomplete()
+        collector.offer(*_greedyPath(dominoHand, rootNumber))
+        addStats(table.getHits() - tableHits)
+        return nodes
+    hits = table.getHits() - tableHits
+    stopTime = None
+    checkClock = False
+    collector.offer(entry[0], entry[1], readPath(4))
+    collector.offer(entry[3], entry[2], readPath(5))
+    addStats(hits)
+    return nodes
+
+
+# This is the beam search engine, for pools too big to search exactly, like a whole boneyard or a double-15 set. It
+# builds the trains one domino at a time, all of them together, and after each domino only keeps the width partial
+# trains that look best. A partial train is ranked on its dots plus the most dots it could still gain, from
+# getReachableBound, then on its length plus the most dominoes it could still gain. So it never holds more than width
+# partial trains and their moves, and its time grows with the pool instead of exploding.
+# Two partial trains that played the same dominoes and have the same open end can only finish the same ways and have
+# the same dots and length, so only one of them is kept. If no partial train ever had to be dropped, every train was
+# searched and the answer is exact. Otherwise the collector is marked incomplete, since the best train may have been
+# dropped, see beamGap for how far off it tends to be.
+# Every train that can't be played on is offered to the collector. Unless the collector keeps a top K, a double is
+# always played as soon as its pip is open, see DOUBLES_FIRST. A deadline, in seconds, is checked after each domino and
+# stops the search with the trains found so far, and the greedy train in case none were, see _greedyPath. stats works
+# as in __searchTrains, the clock being read once per domino and the dropped partial trains counted as pruned.
+# Returns the number of partial trains searched.
+# Internal use only.
+def __beamSearch(dominoHand, rootNumber, collector, width=BEAM_WIDTH, deadline=None, stats=None):
+    tiles = dominoHand.getTiles()
+    dots = dominoHand.getDots()
+    pipMasks = dominoHand.getPipMasks()
+    doubleMasks = dominoHand.getDoubleMasks()
+    copyMask = dominoHand.getCopyMask()
+    doublesFirst = DOUBLES_FIRST and collector.getTopK() == 0
+    reachableBound = dominoHand.getReachableBound
+    stopTime = None if deadline is None else time.monotonic() + deadline
+    if not 0 <= rootNumber < len(pipMasks):
+        collector.offer(0, 0, None)
+        return 0
+
+    # (mask, open end, dot count, path), all of the same length
+    beam = [(dominoHand.getFullMask(), rootNumber, 0, None)]
+    length = 0
+    nodes = leaves = pruned = maxDepth = 0
+    while beam:
+        if stopTime is not None or stats is not None:
+            now = time.monotonic()
+            if stats is not None:
+                stats.sample(length, now)
+            if stopTime is not None and now > stopTime:
+                collector.markIncomplete()
+                collector.offer(*_greedyPath(dominoHand, rootNumber))
+                break
+        children = {}
+        for mask, end, dotCount, path in beam:
+            nodes += 1
+            rest = mask & pipMasks[end] & ~(mask << 1 & copyMask)
+            if not rest:
+                collector.offer(dotCount, length, path)
+                leaves += 1
+                maxDepth = length
+                continue
+            if doublesFirst and rest & doubleMasks[end]:
+                rest &= doubleMasks[end]
+                rest &= -rest
+            while rest:
+                bit = rest & -rest
+                rest ^= bit
+                index = bit.bit_length() - 1
+                top, bottom = tiles[index]
+                other = bottom if top == end else top
+                key = (mask ^ bit) << 5 | other
+                if key not in children:
+                    children[key] = (mask ^ bit, other, dotCount + dots[index], (path, index))
+        length += 1
+        if len(children) > width:
+            collector.markIncomplete()
+            pruned += len(children) - width
+            ranked = []
+            for child in children.values():
+                dotsLeft, dominosLeft = reachableBound(child[0], child[1])
+                ranked.append((child[2] + dotsLeft, dominosLeft, child))
+            beam = [child for _, _, child in heapq.nlargest(width, ranked, key=lambda item: item[:2])]
+        else:
+            beam = list(children.values())
+    if stats is not None:
+        stats.add(nodes, leaves, pruned, maxDepth=maxDepth)
+    return nodes
+
+
+# This is raised inside a search to unwind it once its deadline has passed.
+# Internal use only.
+class _SearchTimeout(Exception):
+    pass
+
+
+# Search engines buildTrain can use, by name. Each one takes a DominoHand, a root number and a TrainCollector and
+# returns how many nodes or states it searched.
+ENGINES = {
+    "bitmask": __searchTrains,
+    "stack": __stackSearch,
+    "memo": __memoSearch,
+    "parallel": __parallelSearch,
+    "graph": __trailSearch,
+    "beam": __beamSearch,
+}
+
+
+# This is the original helper to the main method. This builds and returns all possible trains with the specified
+# starting number and domino pool. buildTrain uses __searchTrains now, but this is kept as the plain reference
+# enumeration since it is the easiest version to check by hand.
+# allTrains may also be a TrainCollector, created with snapshot=Train.getCopy, to stream the trains into it instead of
+# keeping all of them.
 # Internal use only.
 def __buildTrain_helper(dominoPool, rootNumber, train, allTrains):
     if len(dominoPool) == 0:
-        allTrains.add(train.getCopy())
+        __addTrain(allTrains, train)
         return allTrains
 
     rootDominoPool = _findRootDominos(dominoPool, rootNumber)
     if len(rootDominoPool) == 0:
-        allTrains.add(train.getCopy())
+        __addTrain(allTrains, train)
         return allTrains
 
     for rootDomino in rootDominoPool:
@@ -203,6 +1876,81 @@ def __buildTrain_helper(dominoPool, rootNumber, train, allTrains):
     return allTrains
 
 
+# This method records a finished train for __buildTrain_helper, either in a set of all the trains or a TrainCollector.
+# Internal use only.
+def __addTrain(allTrains, train):
+    if isinstance(allTrains, TrainCollector):
+        allTrains.offer(train.getDotCount(), train.getDominoCount(), train)
+    else:
+        allTrains.add(train.getCopy())
+
+
+# The search engines build trains as paths of domino indices into a DominoHand. A path is a chain of links,
+# (previous path, index), ending in None for the empty path, so extending a path never copies the part before it and
+# every train found by a search can be kept without copying. This method reads a path out into a list of indices.
+# Mostly internal but could have an external use
+def _pathIndices(path):
+    indices = []
+    while path is not None:
+        path, index = path
+        indices.append(index)
+    indices.reverse()
+    return indices
+
+
+# This method plays the domino with the most dots at every step until none can be played, which is the first train
+# __searchTrains reaches since __buildPool puts the most dots first. Open doubles go first, see DOUBLES_FIRST. The
+# engines that can't offer a train until they finish use it when they run out of time.
+# Returns (dot count, domino count, path).
+# Mostly internal but could have an external use
+def _greedyPath(dominoHand, rootNumber):
+    tiles = dominoHand.getTiles()
+    dots = dominoHand.getDots()
+    pipMasks = dominoHand.getPipMasks()
+    doubleMasks = dominoHand.getDoubleMasks()
+    copyMask = dominoHand.getCopyMask()
+    mask = dominoHand.getFullMask()
+    end = rootNumber
+    dotCount = length = 0
+    path = None
+    while 0 <= end < len(pipMasks):
+        rest = mask & pipMasks[end] & ~(mask << 1 & copyMask)
+        if DOUBLES_FIRST and rest & doubleMasks[end]:
+            rest &= doubleMasks[end]
+        if not rest:
+            break
+        index = (rest & -rest).bit_length() - 1
+        top, bottom = tiles[index]
+        mask ^= 1 << index
+        end = bottom if top == end else top
+        dotCount += dots[index]
+        length += 1
+        path = (path, index)
+    return dotCount, length, path
+
+
+# A train can only have an odd number of dominoes on a pip where it starts or ends. This method returns the fewest
+# dominoes that have to be left out of a train starting on the pip, given the mask of pips with an odd number of
+# dominoes: every odd pip but the start and one end needs a domino left out, and one domino fixes at most two pips.
+# Mostly internal but could have an external use
+def _leftOutCount(oddPips, pip):
+    oddCount = bin(oddPips).count("1")
+    if oddPips >> pip & 1:
+        return (oddCount - 2) // 2 if oddCount > 2 else 0
+    return oddCount // 2
+
+
+# This method returns the indices of the bits set in a mask, lowest first.
+# Mostly internal but could have an external use
+def _maskIndices(mask):
+    indices = []
+    while mask:
+        bit = mask & -mask
+        mask ^= bit
+        indices.append(bit.bit_length() - 1)
+    return indices
+
+
 # This method finds and returns the train with the most dominos given a set of trains.
 # Mostly internal but could have an external use
 def _findLongestTrain(trainPool):
@@ -213,6 +1961,18 @@ def _findLongestTrain(trainPool):
     return longestTrain
 
 
+# This method builds a Train from domino pairs already facing the way they go in the train, as stored by a
+# ResultCache.
+# Mostly internal but could have an external use
+def _pairsToTrain(pairs):
+    train = Train()
+    for top, bottom in pairs:
+        domino = Domino(top, bottom)
+        domino.setRootNumber(top)
+        train.addDomino(domino)
+    return train
+
+
 # This method finds all possible dominos you could use to start or add to a Train given a pool of dominos and a root
 # number. Used mainly in the buildTrain_helper.
 # Mostly internal but could have an external use
@@ -236,11 +1996,13 @@ def _poolWithout(dominoPool, dominoRemove):
     return returnPool
 
 
-def __buildPool(rawDominoes):
-    dominoPool = set()
-    for domino in rawDominoes.values():
-        dominoPool.add(Domino(domino[0], domino[1]))
-    return dominoPool
+# The dominoes with the most dots go first, so the searches try them first.
+def __buildPool(pairs):
+    dominoPool = []
+    for domino in pairs:
+        dominoPool.append(Domino(domino[0], domino[1]))
+    dominoPool.sort(key=lambda domino: -domino.getDotCount())
+    return DominoHand(dominoPool)
 
 
 def __extractDominoes():
@@ -253,5 +2015,28 @@ def __getRootNumber():
         return int(file.read().strip())
 
 
-# Run program
-buildTrain()
+# This sets the module up to run as the executable: it loads config.env into the environment, sets up logging from
+# LOG_LEVEL and reads the paths and settings buildTrain uses. Importing the module does none of this, so solve can be
+# called in process without touching the caller's environment or logging.
+def loadEnvironment(envPath='config.env'):
+    global imgProcessorOutputPath, rootNumberPath, finalOutputPath, trainEngine, transpositionTablePath, \
+        resultCachePath, searchDeadline
+    load_dotenv(envPath)
+    # Logging setup
+    log_level = os.getenv('LOG_LEVEL', 'ERROR').upper()
+    logging.basicConfig(level=getattr(logging, log_level, logging.ERROR), format='%(message)s')
+
+    imgProcessorOutputPath = os.getenv('IMAGE_PROCESSOR_OUTPUT_PATH')
+    rootNumberPath = os.getenv('ROOT_NUM_PATH')
+    finalOutputPath = os.getenv('TRAIN_BUILDER_OUTPUT_PATH')
+    trainEngine = os.getenv('TRAIN_BUILDER_ENGINE', 'bitmask')
+    transpositionTablePath = os.getenv('TRAIN_BUILDER_TABLE_PATH')
+    resultCachePath = os.getenv('TRAIN_BUILDER_CACHE_PATH')
+    searchDeadline = os.getenv('TRAIN_BUILDER_DEADLINE')
+
+
+# Run program. Worker processes for the parallel search import this module too, so it only runs as the main script.
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    loadEnvironment()
+    buildTrain()
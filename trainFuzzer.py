@@ -0,0 +1,281 @@
+# This script checks the train builder's search engines against the original enumeration, __buildTrain_helper, which
+# tries every train there is and is the easiest version to check by hand. It makes random hands and edge cases from a
+# seed and solves each one with every candidate and with the enumeration. The candidates are every engine in
+# trainBuilder.ENGINES and the ways of solving built on top of them, see MODES. Every candidate has to find the same
+# dots and length as the enumeration for both the most pips train and the longest train, and every train it gives back
+# has to be a real one: dominoes from the hand, each one matching the one before, and nothing left in the hand that
+# could still be played on the end.
+#   python trainFuzzer.py --cases 2000 --seed 1
+#   python trainFuzzer.py --candidates memo memo-table planner --workers 4
+# The hands are checked in worker processes, several at a time. A hand that fails is made as small as it can be while
+# it still fails, one domino taken out at a time, and printed as a call to trainBuilder.solve to reproduce it with.
+
+import argparse                 # Command line
+import atexit                   # Closing the transposition table
+import multiprocessing          # Needed for the worker processes once this is frozen into an executable
+import os
+import random                   # Seeded hands
+import tempfile                 # Somewhere to keep the transposition table
+from collections import Counter  # Checking a train only uses dominoes from the hand
+from concurrent.futures import ProcessPoolExecutor     # Checking several hands at the same time
+import trainBuilder
+
+MAX_PIP = 9                     # Highest pip of the domino set the random hands come from
+MAX_SIZE = 9                    # Most dominoes in a random hand, the enumeration tries every train so it can't be big
+CASES = 500                     # Random hands checked in a run, after the edge cases
+WORKERS = None                  # Worker processes, defaults to the number of CPUs
+CHUNK_SIZE = 20                 # Hands a worker checks per task
+KINDS = ("random", "doubles", "connected", "copies")
+TOP_K = 3                       # Trains the topK candidate asks for
+TABLE_SIZE = 4096               # States in the memo-table candidate's transposition table, small so states get dropped
+# The ways of solving built on the engines, checked as candidates of their own:
+#   - bitmask-prune, stack-prune, parallel-prune: the engine with prune=True
+#   - memo-table: the memo engine with a TranspositionTable kept for every hand a worker checks, so states another hand
+#     solved are found in it. Hands rarely share many, so each hand is solved twice and the second time is answered
+#     from the table, and both times have to agree
+#   - topK: trainBuilder.topK for each objective, the first train is the best and every train it gives has to be real
+#   - frontier: trainBuilder.paretoFrontier, its first train is the most pips train and its last the longest
+#   - planner: a TrainPlanner that plans, takes a domino out and plans, puts it back and plans, then plays the first
+#     domino of its most pips train, whose plan has to be the rest of that train's dots
+MODES = ("bitmask-prune", "stack-prune", "parallel-prune", "memo-table", "topK", "frontier", "planner")
+CANDIDATES = tuple(trainBuilder.ENGINES) + MODES
+
+transpositionTable = None       # The memo-table candidate's table, made the first time a worker needs it
+
+
+# This method makes the hands every run checks first: the ones most likely to trip up an engine at its edges.
+# Returns a list of (domino pairs, root number).
+def makeEdgeCases():
+    fullSet = [(top, bottom) for top in range(MAX_PIP + 1) for bottom in range(top, MAX_PIP + 1)]
+    return [
+        ([], 0),                                            # Nothing in the hand
+        ([(3, 4), (4, 5), (5, 5)], 0),                      # Nothing playable on the root
+        ([(0, 1), (1, 2)], trainBuilder.MAX_PIP + 1),       # A root past the highest pip
+        ([(2, 2)], 2),                                      # Just the root's double
+        ([(pip, pip) for pip in range(MAX_PIP + 1)], 4),    # Every double and nothing to join them
+        ([(0, 0), (0, 1), (1, 1), (1, 2), (2, 2), (2, 0)], 0),  # A loop of doubles, every train uses all of them
+        ([(6, 6), (6, 1), (6, 2), (6, 3), (6, 4)], 6),      # A double then one way out of several
+        ([(1, 2), (2, 3), (3, 1), (1, 4), (4, 5), (5, 1)], 1),  # Two loops through the root, an Euler trail
+        ([(0, 5), (5, 0), (0, 5)], 0),                      # Copies of one domino
+        ([(3, 3), (3, 3), (3, 4), (4, 3)], 3),              # Copies of a double
+        ([pair for pair in fullSet if 7 in pair][:MAX_SIZE], 7),   # Every domino playable on the root
+    ]
+
+
+# This method makes one random hand of a kind, the same one every time for the same seed and case:
+#   - random: dominoes from the set
+#   - doubles: mostly doubles, which every engine but the enumeration plays first, see trainBuilder.DOUBLES_FIRST
+#   - connected: dominoes on a handful of pips, so every train has lots of ways to go
+#   - copies: dominoes on a handful of pips taken from two sets, so some come twice
+# Returns the domino pairs and the root number.
+def makeHand(kind, seed, case):
+    rng = random.Random(f"{seed}-{kind}-{case}")
+    size = rng.randint(1, MAX_SIZE)
+    fullSet = [(top, bottom) for top in range(MAX_PIP + 1) for bottom in range(top, MAX_PIP + 1)]
+    if kind == "doubles":
+        doubles = [(pip, pip) for pip in range(MAX_PIP + 1)]
+        pairs = rng.sample(doubles, rng.randint(size // 2, size))
+        pairs += rng.sample([pair for pair in fullSet if pair not in pairs], size - len(pairs))
+    elif kind in ("connected", "copies"):
+        pips = rng.sample(range(MAX_PIP + 1), 4)
+        fewPips = [(top, bottom) for top in pips for bottom in pips if top <= bottom]
+        pairs = rng.sample(fewPips * 2 if kind == "copies" else fewPips, min(size, len(fewPips)))
+    else:
+        pairs = rng.sample(fullSet, size)
+    # Some dominoes are turned around, the engines shouldn't care which way they come in
+    pairs = [(bottom, top) if rng.random() < 0.5 else (top, bottom) for top, bottom in pairs]
+    rng.shuffle(pairs)
+    rootNumber = rng.choice([pip for pair in pairs for pip in pair] + [rng.randint(0, MAX_PIP)])
+    return pairs, rootNumber
+
+
+# This method solves a hand with the enumeration. It keeps its pool in a set, where copies of a domino are one domino,
+# so a hand with copies is solved with the bitmask engine instead, which is checked against the enumeration on every
+# hand without them.
+# Returns ((dots, length) of the most pips train, (length, dots) of the longest train).
+def solveReference(pairs, rootNumber):
+    codes = [(min(pair), max(pair)) for pair in pairs]
+    if len(set(codes)) < len(codes):
+        result = trainBuilder.solve(pairs, rootNumber, "bitmask")
+        mostPips, longest = result.getMostPips(), result.getLongest()
+        return (mostPips.getDotCount(), mostPips.getDominoCount()), (longest.getDominoCount(), longest.getDotCount())
+    collector = trainBuilder.TrainCollector(snapshot=trainBuilder.Train.getCopy)
+    buildTrainHelper = getattr(trainBuilder, "__buildTrain_helper")
+    buildTrainHelper({trainBuilder.Domino(top, bottom) for top, bottom in pairs}, rootNumber, trainBuilder.Train(),
+                     collector)
+    mostPips, longest = collector.getMostPips(), collector.getLongest()
+    return mostPips[:2], (longest[1], longest[0])
+
+
+# This method checks a train a candidate gave back is one that can be played from the hand.
+# Returns what is wrong with it as text, or None if nothing is.
+def checkTrain(pairs, rootNumber, train):
+    tiles = train.getKey()
+    end = rootNumber
+    for top, bottom in tiles:
+        if top != end:
+            return f"({top}, {bottom}) doesn't match the open end {end}"
+        end = bottom
+    left = Counter((min(pair), max(pair)) for pair in pairs)
+    left.subtract((min(pair), max(pair)) for pair in tiles)
+    if any(count < 0 for count in left.values()):
+        return "plays a domino that isn't in the hand, or plays one twice"
+    if sum(top + bottom for top, bottom in tiles) != train.getDotCount() or len(tiles) != train.getDominoCount():
+        return f"counts {train.getDotCount()} dots and {train.getDominoCount()} dominoes for {tiles}"
+    playable = [code for code, count in left.items() if count > 0 and end in code]
+    if playable:
+        return f"stops with {playable[0]} still playable on {end}"
+    return None
+
+
+# This method returns the worker's transposition table for the memo-table candidate, in a temporary directory that
+# goes when the worker does.
+def getTranspositionTable():
+    global transpositionTable
+    if transpositionTable is None:
+        directory = tempfile.TemporaryDirectory()
+        transpositionTable = trainBuilder.TranspositionTable(os.path.join(directory.name, "table.bin"), TABLE_SIZE)
+        atexit.register(directory.cleanup)
+        atexit.register(transpositionTable.close)
+    return transpositionTable
+
+
+# This method solves a hand with one candidate, see CANDIDATES.
+# Returns the most pips train, the longest train, whether they are sure to be the best, and a list of any other trains
+# the candidate gave back, which have to be real too.
+def solveCandidate(candidate, pairs, rootNumber):
+    dominoes = [trainBuilder.Domino(top, bottom) for top, bottom in pairs]
+    if candidate == "topK":
+        mostPips = trainBuilder.topK(dominoes, rootNumber, TOP_K, "pips")
+        longest = trainBuilder.topK(dominoes, rootNumber, TOP_K, "longest")
+        for objective, trains, rank in (("pips", mostPips, lambda entry: entry[:2]),
+                                        ("longest", longest, lambda entry: (entry[1], entry[0]))):
+            if [rank(entry) for entry in trains] != sorted((rank(entry) for entry in trains), reverse=True):
+                raise ValueError(f"the {objective} top {TOP_K} aren't best first")
+        return mostPips[0][2], longest[0][2], True, [entry[2] for entry in mostPips + longest]
+    if candidate == "frontier":
+        frontier = trainBuilder.paretoFrontier(dominoes, rootNumber)
+        return frontier[0][2], frontier[-1][2], True, [entry[2] for entry in frontier]
+    if candidate == "planner":
+        planner = trainBuilder.TrainPlanner(dominoes, rootNumber)
+        planner.getPlan()
+        if dominoes:
+            planner.removeDomino(dominoes[0])
+            planner.getPlan()
+            planner.addDomino(dominoes[0])
+        mostPips, longest = planner.getPlan()
+        if mostPips.getDominoCount():
+            top, bottom = mostPips.getKey()[0]
+            planner.playDomino(trainBuilder.Domino(top, bottom))
+            played = planner.getPlan()[0]
+            if played.getDotCount() != mostPips.getDotCount() - top - bottom:
+                raise ValueError(f"playing ({top}, {bottom}) left a plan of {played.getDotCount()} dots, expected "
+                                 f"{mostPips.getDotCount() - top - bottom}")
+        return mostPips, longest, True, []
+    engine, _, mode = candidate.partition("-")
+    options = {"workers": 2} if engine == "parallel" else {}
+    if mode == "prune":
+        options["prune"] = True
+    elif mode == "table":
+        options["transpositionTable"] = getTranspositionTable()
+    result = trainBuilder.solve(pairs, rootNumber, engine, **options)
+    if mode == "table":
+        first = result
+        result = trainBuilder.solve(pairs, rootNumber, engine, **options)
+        if first.toDict()["mostPips"] != result.toDict()["mostPips"] or \
+                first.toDict()["longest"] != result.toDict()["longest"]:
+            raise ValueError(f"solving again from the table gave {result}, the first time gave {first}")
+    return result.getMostPips(), result.getLongest(), result.isOptimal(), []
+
+
+# This method checks every candidate on one hand. A candidate that isn't sure its trains are the best, like the beam
+# search when it had to drop trains, only has to give back real trains that are no better than the enumeration's.
+# Returns a list of what failed, as text, empty if nothing did.
+def checkHand(pairs, rootNumber, candidates):
+    failures = []
+    try:
+        reference = solveReference(pairs, rootNumber)
+    except Exception as error:
+        return [f"reference: raised {error!r}"]
+    for candidate in candidates:
+        try:
+            mostPips, longest, optimal, otherTrains = solveCandidate(candidate, pairs, rootNumber)
+        except Exception as error:
+            failures.append(f"{candidate}: raised {error!r}")
+            continue
+        for goal, train in [("most pips", mostPips), ("longest", longest)] + [("other", train) for train in otherTrains]:
+            problem = checkTrain(pairs, rootNumber, train)
+            if problem is not None:
+                failures.append(f"{candidate}: {goal} train {problem}")
+        found = ((mostPips.getDotCount(), mostPips.getDominoCount()),
+                 (longest.getDominoCount(), longest.getDotCount()))
+        if optimal and found != reference:
+            failures.append(f"{candidate}: found {found}, expected {reference}")
+        elif not optimal and (found[0] > reference[0] or found[1] > reference[1]):
+            failures.append(f"{candidate}: found {found}, better than the best, {reference}")
+    return failures
+
+
+# This checks a batch of hands in a worker process.
+# Returns a list of (domino pairs, root number, failures) for the hands that failed.
+def checkHands(hands, candidates):
+    failed = []
+    for pairs, rootNumber in hands:
+        failures = checkHand(pairs, rootNumber, candidates)
+        if failures:
+            failed.append((pairs, rootNumber, failures))
+    return failed
+
+
+# This method makes a failing hand as small as it can be, taking out one domino at a time and keeping each removal the
+# hand still fails without. The candidates are narrowed to the ones that failed, so it only reruns what it has to.
+# Returns the smallest hand found, its root number and its failures.
+def shrinkHand(pairs, rootNumber, failures, candidates):
+    candidates = [candidate for candidate in candidates
+                  if any(failure.startswith(candidate + ":") for failure in failures)] or candidates
+    shrunk = True
+    while shrunk:
+        shrunk = False
+        for index in range(len(pairs)):
+            smaller = pairs[:index] + pairs[index + 1:]
+            smallerFailures = checkHand(smaller, rootNumber, candidates)
+            if smallerFailures:
+                pairs, failures, shrunk = smaller, smallerFailures, True
+                break
+    return pairs, rootNumber, failures
+
+
+# This method checks the edge cases and then cases random hands, spread over the kinds, on worker processes.
+# Returns a list of (domino pairs, root number, failures) for the hands that failed, shrunk.
+def runFuzzer(seed=0, cases=CASES, candidates=None, workers=WORKERS):
+    candidates = list(candidates or CANDIDATES)
+    hands = makeEdgeCases() + [makeHand(KINDS[case % len(KINDS)], seed, case) for case in range(cases)]
+    batches = [hands[start:start + CHUNK_SIZE] for start in range(0, len(hands), CHUNK_SIZE)]
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for batchFailures in executor.map(checkHands, batches, [candidates] * len(batches)):
+            failed.extend(batchFailures)
+    print(f"{len(hands)} hands, {len(failed)} failed")
+    return [shrinkHand(pairs, rootNumber, failures, candidates) for pairs, rootNumber, failures in failed]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the train builder's search engines against the enumeration.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cases", type=int, default=CASES, help="random hands to check after the edge cases")
+    parser.add_argument("--candidates", nargs="+", choices=CANDIDATES, help="engines and modes to check, see MODES")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="worker processes, defaults to the CPUs")
+    args = parser.parse_args()
+
+    failed = runFuzzer(args.seed, args.cases, args.candidates, args.workers)
+    for pairs, rootNumber, failures in failed:
+        print(f"trainBuilder.solve({pairs}, {rootNumber}, ...)")
+        for failure in failures:
+            print(f"    {failure}")
+    return 1 if failed else 0
+
+
+# The worker processes import this module too, so it only runs as the main script.
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    raise SystemExit(main())